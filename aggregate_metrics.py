@@ -0,0 +1,247 @@
+import os
+import json
+import math
+import bisect
+import hashlib
+import argparse
+
+from ndjson_io import read_ndjson
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+# Quantiles are exact up to this many values; past it the P² markers take over
+P2_EXACT = 500
+# Bumped whenever the layout of the state file changes; an older state is rebuilt
+STATE_VERSION = 2
+
+
+# Streaming quantile estimate with the P² algorithm (Jain & Chlamtac, 1985): five markers per quantile,
+# so memory stays constant however many patients are aggregated. The markers are poor estimates for a
+# small cohort, so an accumulator keeps its first P2_EXACT values and starts the markers from them.
+def _p2_new(q):
+    return {
+        "q": q,
+        "heights": None,
+        "positions": None,
+        "desired": None,
+        "increments": [0, q / 2, q, (1 + q) / 2, 1],
+    }
+
+
+def _p2_start(state, samples):
+    """Place the five markers on the sorted samples."""
+    n = len(samples)
+    desired = [1 + (n - 1) * f for f in state["increments"]]
+    positions = [int(round(d)) for d in desired]
+    for i in (1, 2, 3):
+        positions[i] = min(max(positions[i], positions[i - 1] + 1), n - 4 + i)
+    state["heights"] = [samples[p - 1] for p in positions]
+    state["positions"] = positions
+    state["desired"] = desired
+
+
+def _p2_add(state, x):
+    h = state["heights"]
+    n = state["positions"]
+    if x < h[0]:
+        h[0] = x
+        k = 0
+    elif x >= h[4]:
+        h[4] = x
+        k = 3
+    else:
+        k = next(i for i in range(4) if h[i] <= x < h[i + 1])
+    for i in range(k + 1, 5):
+        n[i] += 1
+    state["desired"] = [d + inc for d, inc in zip(state["desired"], state["increments"])]
+
+    for i in (1, 2, 3):
+        d = state["desired"][i] - n[i]
+        if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+            d = 1 if d > 0 else -1
+            parabolic = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+            if h[i - 1] < parabolic < h[i + 1]:
+                h[i] = parabolic
+            else:
+                h[i] = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+            n[i] += d
+
+
+def _p2_value(state, samples=None):
+    if samples is None:
+        return state["heights"][2]
+    if not samples:
+        return None
+    # Exact (linear interpolation) while the accumulator still keeps its values
+    pos = state["q"] * (len(samples) - 1)
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (pos - lo)
+
+
+def new_accumulator(quantiles=QUANTILES):
+    return {"count": 0, "missing": 0, "mean": 0.0, "m2": 0.0, "min": None, "max": None,
+            "samples": [], "quantiles": [_p2_new(q) for q in quantiles]}
+
+
+def accumulate(acc, value):
+    """Add one value; None and NaN are counted as missing and otherwise ignored."""
+    if value is None or math.isnan(value):
+        acc["missing"] += 1
+        return
+    # Welford's update keeps mean and variance numerically stable in one pass
+    acc["count"] += 1
+    delta = value - acc["mean"]
+    acc["mean"] += delta / acc["count"]
+    acc["m2"] += delta * (value - acc["mean"])
+    acc["min"] = value if acc["min"] is None else min(acc["min"], value)
+    acc["max"] = value if acc["max"] is None else max(acc["max"], value)
+    if acc["samples"] is None:
+        for state in acc["quantiles"]:
+            _p2_add(state, value)
+        return
+    bisect.insort(acc["samples"], value)
+    if len(acc["samples"]) > P2_EXACT:
+        for state in acc["quantiles"]:
+            _p2_start(state, acc["samples"])
+        acc["samples"] = None
+
+
+def summarize(acc, digits=4):
+    def rounded(x):
+        return None if x is None else round(x, digits)
+
+    count = acc["count"]
+    return {
+        "count": count,
+        "missing": acc["missing"],
+        "mean": rounded(acc["mean"]) if count else None,
+        "variance": rounded(acc["m2"] / (count - 1)) if count > 1 else None,
+        "std": rounded(math.sqrt(acc["m2"] / (count - 1))) if count > 1 else None,
+        "min": rounded(acc["min"]),
+        "max": rounded(acc["max"]),
+        "quantiles": {str(state["q"]): rounded(_p2_value(state, acc["samples"])) for state in acc["quantiles"]},
+    }
+
+
+def _is_metric(value):
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+def aggregate_records(records, accumulators=None, folded=None, quantiles=QUANTILES):
+    """Fold {"patient": ..., "result": {model: {metric: value}}} records into per-(model, metric) accumulators.
+
+    Patients already in `folded` are skipped, so re-reading a stream that has grown only adds the new ones.
+    """
+    accumulators = {} if accumulators is None else accumulators
+    folded = set() if folded is None else folded
+    for record in records:
+        if record["patient"] in folded:
+            continue
+        folded.add(record["patient"])
+        for model, model_result in record["result"].items():
+            model_acc = accumulators.setdefault(model, {})
+            for metric, value in model_result.items():
+                if not _is_metric(value):
+                    continue
+                if metric not in model_acc:
+                    model_acc[metric] = new_accumulator(quantiles)
+                accumulate(model_acc[metric], value)
+    return accumulators, folded
+
+
+def iter_result_records(path):
+    """Per-patient records from an engine NDJSON stream, or from a monolithic results JSON (loaded whole)."""
+    if path.endswith(".ndjson"):
+        yield from read_ndjson(path)
+        return
+    with open(path, 'r') as f:
+        for patient, result in json.load(f).items():
+            yield {"patient": patient, "result": result}
+
+
+def _averaged(metric):
+    # The checked-in averages leave out the per-pair Pearson values
+    return "_vs_" not in metric
+
+
+def write_summaries(accumulators, averages_file, summary_file=None):
+    # Same shape as average_metrics_per_model_dataset2.json: {model: {metric: mean}}
+    averages = {model: {metric: summarize(acc)["mean"] for metric, acc in metrics.items() if _averaged(metric)}
+                for model, metrics in accumulators.items()}
+    with open(averages_file, 'w') as f:
+        json.dump(averages, f, indent=2)
+    if summary_file:
+        summary = {model: {metric: summarize(acc) for metric, acc in metrics.items()}
+                   for model, metrics in accumulators.items()}
+        with open(summary_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+def _load_state(state_file, source, quantiles):
+    if state_file and os.path.exists(state_file):
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        if (state.get("version") == STATE_VERSION and state.get("source") == source
+                and state.get("quantiles") == list(quantiles)):
+            return state
+    return None
+
+
+def _record_digest(record):
+    return hashlib.sha256(json.dumps(record["result"], sort_keys=True).encode()).hexdigest()
+
+
+def aggregate_file(input_file, averages_file, summary_file=None, state_file=None, quantiles=QUANTILES):
+    """Summarize a per-patient results file.
+
+    With a state file the accumulators are kept between calls together with a hash of every folded patient's
+    result. If each of those patients is still in the input with the same result, only the new patients are
+    folded, however the file was rewritten in between (a completed stream is started over by the next run). If
+    any folded result changed or disappeared, everything is rebuilt.
+    """
+    source = os.path.abspath(input_file)
+    state = _load_state(state_file, source, quantiles)
+    digests = {}
+    for record in iter_result_records(input_file):
+        # The first record of a patient is the one that is folded, as in ndjson_to_json
+        digests.setdefault(record["patient"], _record_digest(record))
+
+    if state is not None and all(digests.get(patient) == digest for patient, digest in state["patients"].items()):
+        accumulators, folded = state["accumulators"], set(state["patients"])
+    else:
+        accumulators, folded = {}, set()
+    if len(folded) < len(digests):
+        aggregate_records(iter_result_records(input_file), accumulators, folded, quantiles)
+    write_summaries(accumulators, averages_file, summary_file)
+
+    if state_file:
+        state = {"version": STATE_VERSION, "source": source, "quantiles": list(quantiles),
+                 "patients": {patient: digests[patient] for patient in sorted(folded)},
+                 "accumulators": accumulators}
+        with open(state_file + ".tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(state_file + ".tmp", state_file)
+    return accumulators
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cohort-level mean/variance/quantiles per model and metric.")
+    parser.add_argument("input", help="per-patient results (.ndjson stream or results .json)")
+    parser.add_argument("--output", help="averages file (default: average_metrics_per_model_<input>.json)")
+    parser.add_argument("--summary", help="also write count/missing/mean/std/min/max/quantiles per metric here")
+    parser.add_argument("--state", help="keep the running accumulators here and only fold new patients next time")
+    parser.add_argument("--quantiles", nargs="+", type=float, default=QUANTILES)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = args.output or f"average_metrics_per_model_{os.path.splitext(os.path.basename(args.input))[0]}.json"
+    aggregate_file(args.input, output, args.summary, args.state, args.quantiles)
+    print(f"✅ Aggregation completed. Results saved to '{output}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import os
+import json
+import math
+import argparse
+import operator
+import threading
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from aggregate_metrics import aggregate_records, summarize
+from cohort_loader import slice_cohort
+from cohort_store import load_any_cohort
+from metrics_engine import DEFAULT_CONFIG, PRESETS, process_cohort, validate_config
+from sparse_cohort import to_sparse
+
+HOST = "127.0.0.1"
+PORT = 8765
+# (cohort, config, model, methods) slices kept in memory
+CACHE_SIZE = 256
+# Cohorts kept loaded; the least recently queried one is dropped beyond this
+COHORT_LIMIT = 8
+
+OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "==": operator.eq,
+             "!=": operator.ne}
+
+
+class AnalysisService:
+    """Loaded cohorts plus an LRU cache of per-model results, shared by every request thread.
+
+    Cohorts are read-only once loaded, so requests compute on them concurrently. A result is cached per
+    (data directory, config, model, methods): a query only computes the models it asks for, and patient
+    selections and filters are applied to the cached results. Directories are keyed by their real path, and
+    each has a generation that evict bumps, so a computation that started before an eviction is not cached.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE, cohort_limit=COHORT_LIMIT):
+        self.cache_size = cache_size
+        self.cohort_limit = cohort_limit
+        self.cohorts = OrderedDict()
+        self.generations = {}
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+    def cohort(self, data_dir):
+        data_dir = os.path.realpath(data_dir)
+        with self.lock:
+            cohort = self.cohorts.get(data_dir)
+            if cohort is not None:
+                self.cohorts.move_to_end(data_dir)
+                return cohort
+        # One load per directory, even when several requests ask for it at once
+        with self.load_lock:
+            cohort = self.cohorts.get(data_dir)
+            if cohort is None:
+                cohort = load_any_cohort(data_dir)
+                with self.lock:
+                    self.cohorts[data_dir] = cohort
+                    while len(self.cohorts) > self.cohort_limit:
+                        self._forget(next(iter(self.cohorts)))
+        return cohort
+
+    def _forget(self, data_dir):
+        # Caller holds self.lock
+        self.cohorts.pop(data_dir, None)
+        self.generations[data_dir] = self.generations.get(data_dir, 0) + 1
+        for key in [key for key in self.results if key[0] == data_dir]:
+            del self.results[key]
+
+    def evict(self, data_dir):
+        """Forget a cohort (e.g. after its files changed) and every result computed from it."""
+        with self.load_lock, self.lock:
+            self._forget(os.path.realpath(data_dir))
+
+    def model_results(self, data_dir, config, model, selected_methods):
+        data_dir = os.path.realpath(data_dir)
+        key = (data_dir, json.dumps(config, sort_keys=True), model, tuple(selected_methods))
+        with self.lock:
+            if key in self.results:
+                self.hits += 1
+                self.results.move_to_end(key)
+                return self.results[key]
+            self.misses += 1
+            generation = self.generations.get(data_dir, 0)
+
+        cohort = slice_cohort(self.cohort(data_dir), models=[model], methods=selected_methods)
+        if config["representation"] == "sparse":
+            cohort = to_sparse(cohort, config["threshold"])
+        results = {patient: result[model] for patient, result in zip(cohort["patients"],
+                                                                     process_cohort(cohort, config))
+                   if model in result}
+        with self.lock:
+            if self.generations.get(data_dir, 0) != generation:
+                # The cohort was evicted while this ran; answer the request but do not cache stale results
+                return results
+            self.results[key] = results
+            while len(self.results) > self.cache_size:
+                self.results.popitem(last=False)
+        return results
+
+    def query(self, request):
+        """Answer a metric query.
+
+        request keys (all optional except data_dir): preset, config (overrides), models, methods, patients,
+        where ([[metric, op, value], ...], all must hold for a patient's model result), metrics (keys to
+        return), per_patient (default true). The response has the matching per-patient results and a
+        per-model summary of them.
+        """
+        data_dir = os.path.realpath(request["data_dir"])
+        cohort = self.cohort(data_dir)
+        config = dict(DEFAULT_CONFIG, **PRESETS[request["preset"]]) if request.get("preset") \
+            else dict(DEFAULT_CONFIG)
+        config.update(request.get("config", {}))
+        selected_methods = request.get("methods") or [m for m in config["methods"] if m in cohort["method_index"]]
+        config["methods"] = list(selected_methods)
+        models = request.get("models") or cohort["models"]
+        config["models"] = None
+        validate_config(config)
+        conditions = [(metric, OPERATORS[op], value) for metric, op, value in request.get("where", [])]
+        wanted = request.get("metrics")
+        patients = request.get("patients")
+        selected_patients = None if patients is None else set(patients)
+
+        matches = {}
+        for model in models:
+            for patient, result in self.model_results(data_dir, config, model, selected_methods).items():
+                if selected_patients is not None and patient not in selected_patients:
+                    continue
+                if not all(result.get(metric) is not None and compare(result[metric], value)
+                           for metric, compare, value in conditions):
+                    continue
+                if wanted:
+                    result = {metric: result.get(metric) for metric in wanted}
+                matches.setdefault(patient, {})[model] = result
+
+        accumulators, _ = aggregate_records(({"patient": p, "result": r} for p, r in matches.items()),
+                                            quantiles=())
+        response = {"n_patients": len(matches),
+                    "summary": {model: {metric: summarize(acc) for metric, acc in model_acc.items()}
+                                for model, model_acc in accumulators.items()}}
+        if request.get("per_patient", True):
+            response["patients"] = matches
+        return response
+
+    def status(self):
+        with self.lock:
+            return {"cohorts": {data_dir: {"patients": len(c["patients"]), "models": c["models"],
+                                           "methods": c["methods"], "features": len(c["features"])}
+                                for data_dir, c in self.cohorts.items()},
+                    "cache": {"entries": len(self.results), "size": self.cache_size, "hits": self.hits,
+                              "misses": self.misses}}
+
+
+def json_safe(value):
+    """value with NaN and +/-Infinity replaced by None, which strict JSON parsers accept."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(json_safe(payload), allow_nan=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/status":
+                self._send(200, service.status())
+            else:
+                self._send(404, {"error": f"Unknown path: {self.path}"})
+
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path == "/query":
+                    self._send(200, service.query(request))
+                elif self.path == "/load":
+                    service.cohort(request["data_dir"])
+                    self._send(200, service.status())
+                elif self.path == "/evict":
+                    service.evict(request["data_dir"])
+                    self._send(200, service.status())
+                else:
+                    self._send(404, {"error": f"Unknown path: {self.path}"})
+            except (KeyError, ValueError, TypeError, OSError) as e:
+                # Bad requests (unknown model, metric operator, directory...) are reported, not fatal
+                self._send(400, {"error": f"{type(e).__name__}: {e}"})
+            except Exception as e:
+                # Anything else is a bug, but the client still gets a JSON answer instead of a dropped connection
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host=HOST, port=PORT, preload=(), cache_size=CACHE_SIZE, cohort_limit=COHORT_LIMIT):
+    service = AnalysisService(cache_size, cohort_limit)
+    for data_dir in preload:
+        service.cohort(data_dir)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    return server, service
+
+
+def request(path, payload=None, host=HOST, port=PORT):
+    """Minimal local client: GET when payload is None, otherwise POST it as JSON; returns the decoded reply."""
+    data = None if payload is None else json.dumps(payload).encode()
+    req = urllib.request.Request(f"http://{host}:{port}{path}", data=data,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read())
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON service answering metric queries on resident "
+                                                 "cohorts.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--preload", nargs="+", default=[], help="patient JSON directories or .cohort stores")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE)
+    parser.add_argument("--cohort-limit", type=int, default=COHORT_LIMIT)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server, _ = serve(args.host, args.port, args.preload, args.cache_size, args.cohort_limit)
+    print(f"✅ Serving on http://{args.host}:{args.port} (POST /query, /load, /evict; GET /status).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import numpy as np
+
+
+def rank_data(scores, mask=None, return_ties=False):
+    """Rank scores along the last axis (rank 1 = highest), giving tied scores their average rank.
+
+    With return_ties=True also returns the tie term sum(t^3 - t) over each row's tie groups of valid entries.
+    """
+    scores = np.asarray(scores, dtype=float)
+    if mask is None:
+        x = -scores
+    else:
+        # Masked-out entries sort after every valid one and get rank 0
+        x = np.full(np.broadcast_shapes(scores.shape, np.shape(mask)), np.inf)
+        np.negative(scores, out=x, where=mask)
+    shape = x.shape
+    n = shape[-1]
+    if n == 0:
+        # No features: nothing to rank and no ties
+        ranks = np.zeros(shape)
+        return (ranks, np.zeros(shape[:-1])) if return_ties else ranks
+    rows = x.size // n
+    x = x.reshape(rows, n)
+
+    # One argsort gives every row its positions; scattering them back costs less than a second argsort
+    order = np.argsort(x, axis=-1)
+    order += np.arange(0, rows * n, n)[:, None]
+    x_sorted = x.reshape(-1)[order]
+    ranks = np.empty(rows * n)
+    ranks[order] = np.arange(1.0, n + 1)
+    ties = np.zeros(rows)
+
+    equal = x_sorted[:, 1:] == x_sorted[:, :-1]
+    if mask is not None:
+        equal &= x_sorted[:, 1:] != np.inf
+    tied = np.flatnonzero(equal.any(axis=1))
+    if tied.size:
+        # Only rows that contain ties pay for the tie-group bookkeeping
+        tied_sorted = x_sorted[tied]
+        starts = np.ones(tied_sorted.shape, dtype=bool)
+        starts[:, 1:] = tied_sorted[:, 1:] != tied_sorted[:, :-1]
+        starts = starts.reshape(-1)
+        first = np.flatnonzero(starts)
+        size = np.diff(np.append(first, starts.size)).astype(float)
+        group = np.cumsum(starts) - 1
+        ranks[order[tied].reshape(-1)] = (first % n + (size + 1) / 2)[group]
+
+        term = size ** 3 - size
+        if mask is not None:
+            term = np.where(tied_sorted.reshape(-1)[first] != np.inf, term, 0)
+        ties[tied] = np.bincount(first // n, weights=term, minlength=len(tied))
+
+    ranks = ranks.reshape(shape)
+    if mask is not None:
+        ranks[~np.broadcast_to(mask, shape)] = 0
+    if return_ties:
+        return ranks, ties.reshape(shape[:-1])
+    return ranks
+
+
+def batch_kendalls_w(scores, feature_mask=None, method_mask=None):
+    """Tie-corrected Kendall's W for a stacked (N x k x n) score tensor; NaN where k < 2 or n < 2.
+
+    W = 12 S / (k^2 (n^3 - n) - k sum(t^3 - t)) on average ranks, so the result does not depend on the order
+    features are listed in. Rows where every method ties every feature are NaN.
+    """
+    scores = np.asarray(scores, dtype=float)
+    N, k, n = scores.shape
+    if feature_mask is None:
+        feature_mask = np.ones((N, n), dtype=bool)
+    if method_mask is None:
+        method_mask = np.ones((N, k), dtype=bool)
+
+    cell_mask = feature_mask[:, None, :] & method_mask[:, :, None]
+    ranks, ties = rank_data(scores, cell_mask, return_ties=True)
+
+    k_eff = method_mask.sum(axis=1)
+    n_eff = feature_mask.sum(axis=1)
+    R = ranks.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Masked features have R = 0, so sum(R^2) - n R_bar^2 is the sum of squares over the valid ones
+        S = (R ** 2).sum(axis=1) - R.sum(axis=1) ** 2 / n_eff
+        denominator = k_eff ** 2 * (n_eff.astype(float) ** 3 - n_eff) - k_eff * ties.sum(axis=1)
+        W = np.where(denominator > 0, 12 * S / denominator, np.nan)
+    W[(k_eff < 2) | (n_eff < 2)] = np.nan
+    return W
+
+
+
+def kendalls_w_from_rank_matrix(rank_matrix):
+    """Tie-corrected Kendall's W of one (methods x features) matrix of ranks; None where it is undefined."""
+    rank_matrix = np.array(rank_matrix)
+    k, n = rank_matrix.shape
+    if k < 2 or n < 2:
+        return None
+    # Ranking the negated ranks gives them back unchanged, so batch_kendalls_w sees (and corrects for) their ties
+    W = batch_kendalls_w(-rank_matrix[None].astype(float))[0]
+    return None if np.isnan(W) else W
+
+def _tie_pairs(sorted_values, valid):
+    """Number of tied pairs per row of an ascending-sorted (N x n) array, counting only valid entries."""
+    n = sorted_values.shape[-1]
+    pos = np.arange(n)
+    starts = np.ones(sorted_values.shape, dtype=bool)
+    starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    # Each entry pairs with the earlier members of its tie group
+    first = np.maximum.accumulate(np.where(starts, pos, 0), axis=-1)
+    return np.where(valid, pos - first, 0).sum(axis=-1)
+
+
+# Block length below which _count_inversions compares pairs directly instead of merging
+_BASE_BLOCK = 16
+
+
+def _count_inversions(a):
+    """Pairs i < j with a[i] > a[j] in every row of an (N x n) array, by a bottom-up merge sort.
+
+    Each level merges neighbouring sorted blocks for all rows at once; a stable argsort of two sorted runs is a
+    linear merge, and a right-block element's merged position tells how many left-block elements exceed it.
+    """
+    N, n = a.shape
+    size = max(1 << max(n - 1, 0).bit_length(), _BASE_BLOCK)
+    # +inf padding sorts last and is never greater than anything, so it adds no inversions
+    a = np.concatenate([a, np.full((N, size - n), np.inf)], axis=1)
+    # Small blocks are cheaper to count pairwise and sort directly than to merge level by level
+    blocks = a.reshape(N, size // _BASE_BLOCK, _BASE_BLOCK)
+    before = np.triu(np.ones((_BASE_BLOCK, _BASE_BLOCK), dtype=bool), 1)
+    inversions = ((blocks[..., :, None] > blocks[..., None, :]) & before).sum(axis=(1, 2, 3))
+    a = np.sort(blocks, axis=-1).reshape(N, size)
+    width = _BASE_BLOCK
+    while width < size:
+        blocks = a.reshape(N, size // (2 * width), 2 * width)
+        order = np.argsort(blocks, axis=-1, kind="stable")
+        position = np.empty_like(order)
+        np.put_along_axis(position, order, np.arange(2 * width), axis=-1)
+        # Right element j lands at j + (left elements <= it); the remaining left elements are greater
+        right = position[..., width:] - np.arange(width)
+        inversions += (width - right).sum(axis=(1, 2))
+        a = np.take_along_axis(blocks, order, axis=-1).reshape(N, size)
+        width *= 2
+    return inversions
+
+
+def batch_kendall_tau(x, y, mask=None):
+    """Kendall's tau-b between x and y along the last axis of (N x n) arrays, over the masked entries.
+
+    Knight's O(n log n) algorithm: sort by (x, y), count discordant pairs as inversions of y, and correct for
+    ties in x, in y and in both. NaN where fewer than two entries are valid or either side is constant.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    N, n = x.shape
+    valid = np.ones((N, n), dtype=bool) if mask is None else np.broadcast_to(mask, (N, n))
+    # Invalid entries become one (+inf, +inf) group after all valid ones: concordant with them, never discordant
+    x = np.where(valid, x, np.inf)
+    y = np.where(valid, y, np.inf)
+
+    order = np.lexsort((y, x), axis=-1)
+    xs = np.take_along_axis(x, order, axis=-1)
+    ys = np.take_along_axis(y, order, axis=-1)
+    valid_sorted = np.take_along_axis(valid, order, axis=-1)
+
+    count = valid.sum(axis=-1)
+    n0 = count * (count - 1) // 2
+    x_ties = _tie_pairs(xs, valid_sorted)
+    # Within an x tie group y is ascending, so a pair tied in x and y is also adjacent in a (x, y)-keyed run
+    joint_starts = np.ones(xs.shape, dtype=bool)
+    joint_starts[:, 1:] = (xs[:, 1:] != xs[:, :-1]) | (ys[:, 1:] != ys[:, :-1])
+    pos = np.arange(n)
+    joint_first = np.maximum.accumulate(np.where(joint_starts, pos, 0), axis=-1)
+    joint_ties = np.where(valid_sorted, pos - joint_first, 0).sum(axis=-1)
+
+    discordant = _count_inversions(ys)
+    y_sorted = np.sort(ys, axis=-1)
+    y_ties = _tie_pairs(y_sorted, np.isfinite(y_sorted))
+
+    concordant = n0 - x_ties - y_ties + joint_ties - discordant
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tau = (concordant - discordant) / np.sqrt((n0 - x_ties) * (n0 - y_ties).astype(float))
+    tau[(count < 2) | (n0 == x_ties) | (n0 == y_ties)] = np.nan
+    return tau
+
+
+def batch_kendall_tau_pairs(scores, feature_mask, method_mask, pairs):
+    """Kendall's tau-b for each method index pair of an (N x k x n) tensor; (N x pairs), NaN for missing methods."""
+    taus = np.full((len(scores), len(pairs)), np.nan)
+    for c, (i, j) in enumerate(pairs):
+        available = method_mask[:, i] & method_mask[:, j]
+        taus[available, c] = batch_kendall_tau(scores[available, i], scores[available, j], feature_mask[available])
+    return taus
+
+
+def batch_sign_agreement(scores, feature_mask, method_mask, zero_policy="ignore", threshold=0):
+    """Share of features on which all methods agree on the sign; NaN where no feature qualifies.
+
+    zero_policy "ignore" drops zero signs and needs at least two non-zero ones per feature;
+    "skip" leaves out every feature that is zero in any available method. Scores with abs(s) < threshold
+    count as zero, without a thresholded copy of the tensor.
+    """
+    cell_mask = feature_mask[:, None, :] & method_mask[:, :, None]
+    positive = (scores > 0) & cell_mask
+    negative = (scores < 0) & cell_mask
+    if threshold:
+        positive &= scores >= threshold
+        negative &= scores <= -threshold
+    positive = positive.sum(axis=1)
+    negative = negative.sum(axis=1)
+    nonzero = positive + negative
+
+    if zero_policy == "ignore":
+        counted = feature_mask & (nonzero >= 2)
+    elif zero_policy == "skip":
+        counted = feature_mask & (nonzero == method_mask.sum(axis=1)[:, None])
+    else:
+        raise ValueError(f"Unknown zero policy: {zero_policy}")
+
+    agreed = counted & ((positive == 0) | (negative == 0))
+    total = counted.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, agreed.sum(axis=1) / total, np.nan)
+
+
+def top_k_positions(magnitude, k_max):
+    """Position of every entry in the descending order of magnitude along the last axis, ties broken by index.
+
+    Only the first k_max positions are resolved (one argpartition plus a k_max-wide sort); the rest get n.
+    """
+    n = magnitude.shape[-1]
+    k_max = min(k_max, n)
+    position = np.full(magnitude.shape, n, dtype=np.intp)
+    if k_max == 0:
+        return position
+
+    flat = magnitude.reshape(-1, n)
+    selected = np.argpartition(-flat, k_max - 1, axis=-1)[:, :k_max]
+    selected_mag = np.take_along_axis(flat, selected, axis=-1)
+
+    # argpartition is not stable: when the k_max-th value is tied with unselected entries, membership is
+    # ambiguous, and those rows fall back to a full stable sort
+    boundary = selected_mag.min(axis=-1)
+    ambiguous = np.flatnonzero((flat >= boundary[:, None]).sum(axis=-1) > k_max)
+    if ambiguous.size:
+        selected[ambiguous] = np.argsort(-flat[ambiguous], axis=-1, kind="stable")[:, :k_max]
+        selected_mag[ambiguous] = np.take_along_axis(flat[ambiguous], selected[ambiguous], axis=-1)
+
+    order = np.lexsort((selected, -selected_mag), axis=-1)
+    selected = np.take_along_axis(selected, order, axis=-1)
+    np.put_along_axis(position.reshape(-1, n), selected, np.arange(k_max), axis=-1)
+    return position
+
+
+def batch_intersection_at_k(scores, feature_mask, method_mask, k_values, pairs, threshold=0):
+    """Mean top-K overlap (by |score|) over method index pairs, one column per K; NaN where no pair is available.
+
+    All K values come from one partial sort: a feature is in both top-K sets exactly when the larger of its
+    two positions is below K, so a cumulative count of that position gives the overlap for every K at once.
+    Scores with abs(s) < threshold count as zero.
+    """
+    N, k, n = scores.shape
+    k_values = np.asarray(k_values)
+    k_max = int(k_values.max())
+    magnitude = np.abs(scores)
+    if threshold:
+        magnitude[magnitude < threshold] = 0
+    magnitude[~np.broadcast_to(feature_mask[:, None, :], magnitude.shape)] = -np.inf
+    # Ties are broken by feature order, like sorted(..., key=abs) over the sorted feature list
+    position = top_k_positions(magnitude, k_max)
+    # Out-of-scope features land in the overflow bin k_max, which no K counts
+    position[~np.broadcast_to(feature_mask[:, None, :], position.shape)] = k_max
+
+    rows = np.arange(N)[:, None] * (k_max + 1)
+    overlap_sum = np.zeros((N, len(k_values)))
+    n_pairs = np.zeros(N, dtype=int)
+    for i, j in pairs:
+        both = np.minimum(np.maximum(position[:, i], position[:, j]), k_max)
+        counts = np.bincount((rows + both).ravel(), minlength=N * (k_max + 1)).reshape(N, k_max + 1)
+        overlap = np.cumsum(counts, axis=1)[:, k_values - 1] / k_values
+        available = method_mask[:, i] & method_mask[:, j]
+        overlap_sum += np.where(available[:, None], overlap, 0)
+        n_pairs += available
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(n_pairs[:, None] > 0, overlap_sum / n_pairs[:, None], np.nan)
+
+
+def batch_pearson_matrix(scores, feature_mask, method_mask=None, constant_policy="nan", threshold=0):
+    """Full method x method Pearson matrix for every row of an (N x k x n) tensor, over the masked features.
+
+    constant_policy decides what r is when a method's vector is constant (or has < 2 features):
+    "nan" returns NaN, "zero" returns 0. Rows/columns of masked-out methods are always NaN.
+    Scores with abs(s) < threshold count as zero.
+    """
+    scores = np.asarray(scores, dtype=float)
+    N, k, n = scores.shape
+    if method_mask is None:
+        method_mask = np.ones((N, k), dtype=bool)
+    mask = feature_mask[:, None, :]
+    count = feature_mask.sum(axis=1)[:, None, None]
+
+    kept = mask & ~(np.abs(scores) < threshold) if threshold else mask
+    centered = np.where(kept, scores, 0)
+    centered = np.where(mask, centered - centered.sum(axis=-1, keepdims=True) / np.maximum(count, 1), 0)
+    cov = np.einsum("bif,bjf->bij", centered, centered)
+    norm = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+
+    degenerate = (norm == 0) | (count[:, :, 0] < 2)
+    denom = norm[:, :, None] * norm[:, None, :]
+    undefined = degenerate[:, :, None] | degenerate[:, None, :]
+    r = cov / np.where(undefined, 1, denom)
+    if constant_policy == "nan":
+        r[undefined] = np.nan
+    elif constant_policy == "zero":
+        r[undefined] = 0
+    else:
+        raise ValueError(f"Unknown constant policy: {constant_policy}")
+    r[~(method_mask[:, :, None] & method_mask[:, None, :])] = np.nan
+    return r
+
+
+def batch_pearson_avg(scores, feature_mask, method_mask, pairs, constant_policy="nan", threshold=0):
+    """Per-pair Pearson r over method index pairs plus their mean; returns (mean, pair_r, number of pairs used).
+
+    A NaN pair (constant vector under the "nan" policy) makes the mean NaN, as np.mean over np.corrcoef did.
+    """
+    r = batch_pearson_matrix(scores, feature_mask, method_mask, constant_policy, threshold)
+    pair_r = np.stack([r[:, i, j] for i, j in pairs], axis=1) if pairs else np.empty((len(r), 0))
+    available = np.stack([method_mask[:, i] & method_mask[:, j] for i, j in pairs], axis=1) \
+        if pairs else np.empty((len(r), 0), dtype=bool)
+    available &= (feature_mask.sum(axis=1) > 1)[:, None]
+    n_pairs = available.sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        mean = np.where(n_pairs > 0, np.sum(np.where(available, pair_r, 0), axis=1) / np.maximum(n_pairs, 1), np.nan)
+    return mean, np.where(available, pair_r, np.nan), n_pairs
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import itertools
+import subprocess
+
+import numpy as np
+
+from batch_metrics import (batch_intersection_at_k, batch_kendall_tau_pairs, batch_kendalls_w, batch_pearson_avg,
+                           batch_sign_agreement)
+from cohort_store import is_store, load_any_cohort
+from vif_analysis import compute_vif_batch
+
+methods = ["SHAP", "Lime", "Inherent"]
+MODELS = ["LogisticRegression", "DecisionTree", "XGBOOST"]
+RESULTS_FILE = "benchmark_results.jsonl"
+
+
+def generate_synthetic_cohort(out_dir, n_patients=200, n_features=183, models=MODELS, methods=methods,
+                              sparsity=0.5, seed=0):
+    """Write patient_<i>_explanation.json files in the {model: {method: {feature: value}}} schema.
+
+    Methods share a per-(patient, model) signal plus noise so the agreement metrics are not degenerate;
+    a `sparsity` fraction of each method's values is exactly 0.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    features = [f"feature_{i}" for i in range(n_features)]
+    for p in range(n_patients):
+        data = {}
+        for model in models:
+            signal = rng.normal(scale=3.0, size=n_features)
+            methods_data = {}
+            for m in methods:
+                values = signal + rng.normal(size=n_features)
+                values[rng.random(n_features) < sparsity] = 0
+                methods_data[m] = dict(zip(features, values.tolist()))
+            data[model] = methods_data
+        with open(os.path.join(out_dir, f"patient_{p}_explanation.json"), 'w') as f:
+            json.dump(data, f)
+    return out_dir
+
+
+def _time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": float(np.median(timings))}
+
+
+def load_any(data_dir, methods=methods):
+    cohort = load_any_cohort(data_dir, methods)
+    if is_store(data_dir):
+        # Reading the whole store is the fair counterpart of parsing every JSON file
+        return dict(cohort, values=np.array(cohort["values"]), method_mask=np.array(cohort["method_mask"]),
+                    feature_mask=np.array(cohort["feature_mask"]), presence=np.array(cohort["presence"]))
+    return cohort
+
+
+def run_benchmarks(data_dir, methods=methods, top_k=(5, 10), repeat=3):
+    timings = {"load": _time(lambda: load_any(data_dir, methods), repeat)}
+
+    cohort = load_any(data_dir, methods)
+    P, M, K, F = cohort["values"].shape
+    values = cohort["values"].reshape(P * M, K, F)
+    method_mask = cohort["method_mask"].reshape(P * M, K)
+    feature_mask = cohort["feature_mask"].reshape(P * M, F)
+    common_mask = feature_mask & ((values != 0) | ~method_mask[..., None]).all(axis=1)
+    pairs = list(itertools.combinations(range(K), 2))
+
+    timings["kendall_w"] = _time(lambda: batch_kendalls_w(values, common_mask, method_mask), repeat)
+    timings["kendall_tau"] = _time(lambda: batch_kendall_tau_pairs(values, common_mask, method_mask, pairs), repeat)
+    timings["sign_agreement"] = _time(lambda: batch_sign_agreement(values, feature_mask, method_mask), repeat)
+    timings["intersection_at_k"] = _time(
+        lambda: batch_intersection_at_k(values, feature_mask, method_mask, list(top_k), pairs), repeat)
+    timings["pearson"] = _time(lambda: batch_pearson_avg(values, feature_mask, method_mask, pairs), repeat)
+    timings["vif"] = _time(lambda: compute_vif_batch(values, method_mask, common_mask), repeat)
+    return {"shape": [P, M, K, F], "timings": timings}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(results_file, params):
+    """Most recent saved run with the same parameters, if any."""
+    if not os.path.exists(results_file):
+        return None
+    previous = None
+    with open(results_file, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            if record["params"] == params:
+                previous = record
+    return previous
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time the load phase and each correlation metric.")
+    parser.add_argument("--data-dir", help="benchmark an existing explanation directory or .cohort store "
+                                           "instead of synthetic data")
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--features", type=int, default=183)
+    parser.add_argument("--models", type=int, default=len(MODELS))
+    parser.add_argument("--methods", nargs="+", default=methods)
+    parser.add_argument("--sparsity", type=float, default=0.5)
+    parser.add_argument("--top-k", nargs="+", type=int, default=[5, 10])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the generated synthetic files")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.data_dir:
+        params = {"data_dir": args.data_dir, "methods": args.methods, "top_k": args.top_k}
+        data_dir = args.data_dir
+    else:
+        params = {"patients": args.patients, "features": args.features, "models": args.models,
+                  "methods": args.methods, "sparsity": args.sparsity, "top_k": args.top_k, "seed": args.seed}
+        models = [f"model_{i}" for i in range(args.models)]
+        data_dir = generate_synthetic_cohort(tempfile.mkdtemp(prefix="synthetic_cohort_"), args.patients,
+                                             args.features, models, args.methods, args.sparsity, args.seed)
+
+    try:
+        result = run_benchmarks(data_dir, args.methods, args.top_k, args.repeat)
+    finally:
+        if not args.data_dir and not args.keep:
+            shutil.rmtree(data_dir)
+    if not args.data_dir and args.keep:
+        print(f"Synthetic cohort kept in '{data_dir}'.")
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "params": params,
+        **result,
+    }
+    previous = previous_run(args.output, params)
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+
+    print(f"Cohort shape (patients, models, methods, features): {tuple(result['shape'])}")
+    for name, timing in result["timings"].items():
+        line = f"  {name:<18} {timing['min'] * 1000:10.2f} ms"
+        if previous and name in previous["timings"]:
+            line += f"   ({timing['min'] / previous['timings'][name]['min']:.2f}x vs {previous['commit']})"
+        print(line)
+    print(f"✅ Benchmark completed. Results appended to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
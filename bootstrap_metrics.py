@@ -0,0 +1,152 @@
+import os
+import json
+import math
+import argparse
+import itertools
+from functools import partial
+
+import numpy as np
+
+from aggregate_metrics import iter_result_records
+from parallel_driver import WORKERS, run_parallel
+
+RESAMPLES = 10000
+BATCH_SIZE = 250
+CONFIDENCE = 0.95
+
+
+def metric_matrix(records, metrics=None):
+    """Stack per-patient results into X[patient, model, metric] with NaN where a model or value is missing.
+
+    Without an explicit list every numeric metric is used except the per-pair Pearson values.
+    """
+    patients = []
+    rows = []
+    models = {}
+    found = {}
+    for record in records:
+        patients.append(record["patient"])
+        row = {}
+        for model, model_result in record["result"].items():
+            models.setdefault(model, None)
+            for metric, value in model_result.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    found.setdefault(metric, None)
+                    row[model, metric] = value
+        rows.append(row)
+
+    models = list(models)
+    metrics = [m for m in found if "_vs_" not in m] if metrics is None else list(metrics)
+    X = np.full((len(patients), len(models), len(metrics)), np.nan)
+    for p, row in enumerate(rows):
+        for mi, model in enumerate(models):
+            for q, metric in enumerate(metrics):
+                X[p, mi, q] = row.get((model, metric), np.nan)
+    return patients, models, metrics, X
+
+
+def _resample_batch(task, columns, observed, differences):
+    """Bootstrap means of every column and sign-flip statistics of every model difference for `size` draws.
+
+    A resample of patients is a row of counts, so the means of all columns for all draws are one matrix
+    product instead of fancy-indexing a (draws x patients x columns) array.
+    """
+    seed, size = task
+    rng = np.random.default_rng(seed)
+    P = columns.shape[0]
+
+    draws = rng.integers(0, P, size=(size, P))
+    counts = np.bincount((draws + P * np.arange(size)[:, None]).ravel(), minlength=size * P).reshape(size, P)
+    counts = counts.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        boot = (counts @ columns) / (counts @ observed)
+
+    # Under "no difference between the models" each patient's paired difference is equally likely to flip sign
+    signs = rng.integers(0, 2, size=(size, P)) * 2.0 - 1.0
+    flips = signs @ differences
+    return boot, flips
+
+
+def bootstrap(X, models, metrics, resamples=RESAMPLES, confidence=CONFIDENCE, batch_size=BATCH_SIZE, seed=0,
+              workers=1):
+    """Percentile CIs of every model's mean metric and paired model-difference CIs and p-values.
+
+    Patients are resampled jointly across models, so the differences are paired bootstrap draws; the
+    difference p-values come from a sign-flip permutation test on the per-patient differences.
+    Draws are split into seeded batches, which gives the same result for any number of workers.
+    """
+    P, M, Q = X.shape
+    model_pairs = list(itertools.combinations(range(M), 2))
+    D = np.stack([X[:, a] - X[:, b] for a, b in model_pairs], axis=1) if model_pairs \
+        else np.empty((P, 0, Q))
+
+    values = np.concatenate([X.reshape(P, M * Q), D.reshape(P, -1)], axis=1)
+    observed = ~np.isnan(values)
+    columns = np.where(observed, values, 0.0)
+    differences = columns[:, M * Q:]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        estimate = columns.sum(axis=0) / observed.sum(axis=0)
+        flip_scale = observed[:, M * Q:].sum(axis=0)
+
+    n_batches = math.ceil(resamples / batch_size)
+    sizes = [min(batch_size, resamples - b * batch_size) for b in range(n_batches)]
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    func = partial(_resample_batch, columns=columns, observed=observed.astype(np.float64),
+                   differences=differences)
+    batches = run_parallel(func, list(zip(seeds, sizes)), workers, chunksize=1)
+    boot = np.concatenate([b for b, _ in batches])
+    flips = np.concatenate([f for _, f in batches])
+
+    alpha = (1 - confidence) / 2
+    with np.errstate(invalid="ignore"):
+        low, high = np.nanpercentile(boot, [100 * alpha, 100 * (1 - alpha)], axis=0)
+        flip_means = flips / flip_scale
+    observed_diff = estimate[M * Q:]
+    extreme = (np.abs(flip_means) >= np.abs(observed_diff) - 1e-12).sum(axis=0)
+    p_values = (1 + extreme) / (1 + resamples)
+    n = observed.sum(axis=0)
+
+    def summary(c):
+        if not n[c]:
+            return {"n": 0, "mean": None, "ci_low": None, "ci_high": None}
+        return {"n": int(n[c]), "mean": round(float(estimate[c]), 4),
+                "ci_low": round(float(low[c]), 4), "ci_high": round(float(high[c]), 4)}
+
+    results = {"resamples": resamples, "confidence": confidence, "models": {}, "differences": {}}
+    for mi, model in enumerate(models):
+        results["models"][model] = {metric: summary(mi * Q + q) for q, metric in enumerate(metrics)}
+    for d, (a, b) in enumerate(model_pairs):
+        pair_result = {}
+        for q, metric in enumerate(metrics):
+            c = M * Q + d * Q + q
+            pair_result[metric] = dict(summary(c), p_value=round(float(p_values[c - M * Q]), 4) if n[c] else None)
+        results["differences"][f"{models[a]}_vs_{models[b]}"] = pair_result
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bootstrap CIs and model-difference p-values of cohort metrics.")
+    parser.add_argument("input", help="per-patient results (.ndjson stream or results .json)")
+    parser.add_argument("--output", help="output JSON file (default: bootstrap_<input>.json)")
+    parser.add_argument("--metrics", nargs="+", help="metrics to resample (default: all but per-pair Pearson)")
+    parser.add_argument("--resamples", type=int, default=RESAMPLES)
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = args.output or f"bootstrap_{os.path.splitext(os.path.basename(args.input))[0]}.json"
+    _, models, metrics, X = metric_matrix(iter_result_records(args.input), args.metrics)
+    results = bootstrap(X, models, metrics, args.resamples, args.confidence, args.batch_size, args.seed,
+                        args.workers)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Bootstrap completed ({args.resamples} resamples). Results saved to '{output}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import os
+import numpy as np
+
+from names import normalize_feature, normalize_method, normalize_model
+from prefetch_loader import PREFETCH_THREADS, iter_prefetched
+
+DATA_DIR = "patient_contributions_DataSet1"
+methods = ["SHAP", "Lime", "Inherent"]
+
+
+def list_patient_files(data_dir=DATA_DIR):
+    return sorted(f for f in os.listdir(data_dir) if f.endswith(".json"))
+
+
+def iter_patient_files(data_dir=DATA_DIR, threads=PREFETCH_THREADS):
+    """Yield (filename, explanation) in filename order; the next files are read while the caller works."""
+    filenames = list_patient_files(data_dir)
+    yield from zip(filenames, iter_prefetched((os.path.join(data_dir, f) for f in filenames), threads=threads))
+
+
+def intern_records(records, methods=methods, dtype=np.float64, models=None, features=None, threshold=None):
+    """Read (patient, {model: {method: {feature: value}}}) records into compact index/value arrays.
+
+    Model, method and feature names are canonicalised (see names.py), after which everything is addressed by
+    integer index. models/features fix the vocabulary (and its order); names outside it are skipped. With a
+    threshold, zeros and values with abs(v) < threshold are dropped as they are read.
+    Returns (patients, models, features, entries): one (patient, model, method, feature indices, values) entry
+    per method section, with indices into the returned feature list.
+    """
+    method_index = {m: i for i, m in enumerate(methods)}
+    model_index = {} if models is None else {model: i for i, model in enumerate(models)}
+    feature_index = {} if features is None else {f: i for i, f in enumerate(features)}
+
+    # One pass over the records: intern names and keep only compact index/value arrays
+    patients = []
+    entries = []
+    for patient, data in records:
+        p = len(patients)
+        patients.append(patient)
+        for model, methods_data in data.items():
+            model = normalize_model(model)
+            if models is None:
+                mi = model_index.setdefault(model, len(model_index))
+            elif model in model_index:
+                mi = model_index[model]
+            else:
+                continue
+            for m, feature_values in methods_data.items():
+                k = method_index.get(normalize_method(m))
+                if k is None:
+                    continue
+                try:
+                    if features is None:
+                        # Raw feature names are interned here and canonicalised once per distinct name below
+                        n = len(feature_values)
+                        idx = np.fromiter((feature_index.setdefault(f, len(feature_index)) for f in feature_values),
+                                          dtype=np.intp, count=n)
+                        vals = np.fromiter(feature_values.values(), dtype=dtype, count=n)
+                    else:
+                        kept = []
+                        for f, v in feature_values.items():
+                            i = feature_index.get(f)
+                            if i is None:
+                                i = feature_index.get(normalize_feature(f))
+                            if i is not None:
+                                kept.append((i, v))
+                        idx = np.fromiter((i for i, _ in kept), dtype=np.intp, count=len(kept))
+                        vals = np.fromiter((v for _, v in kept), dtype=dtype, count=len(kept))
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"{patient}: non-numeric contribution in '{model}/{m}' ({e})") from None
+                if threshold is not None:
+                    keep = (vals != 0) & ~(np.abs(vals) < threshold)
+                    idx, vals = idx[keep], vals[keep]
+                entries.append((p, mi, k, idx, vals))
+
+    if features is None:
+        canonical = {f: normalize_feature(f) for f in feature_index}
+        # Features are stored in sorted order, the same order the scripts iterate them in
+        features = sorted(set(canonical.values()))
+        position = {f: new for new, f in enumerate(features)}
+        remap = np.empty(len(feature_index), dtype=np.intp)
+        for f, i in feature_index.items():
+            remap[i] = position[canonical[f]]
+        if len(features) < len(feature_index):
+            # Spellings of one feature share its column, but not within a single method
+            for p, mi, k, idx, _ in entries:
+                if len(np.unique(remap[idx])) < len(idx):
+                    raise ValueError(f"{patients[p]}: a feature is listed twice (under different spellings) in "
+                                     f"'{list(model_index)[mi]}/{methods[k]}'")
+    else:
+        features = list(features)
+        remap = np.arange(len(features))
+
+    entries = [(p, mi, k, remap[idx], vals) for p, mi, k, idx, vals in entries]
+    return patients, list(model_index), features, entries
+
+
+def build_cohort(records, methods=methods, dtype=np.float64, models=None, features=None):
+    """Pack (patient, {model: {method: {feature: value}}}) records into one dense tensor (see intern_records)."""
+    patients, models, features, entries = intern_records(records, methods, dtype, models, features)
+    shape = (len(patients), len(models), len(methods), len(features))
+    values = np.zeros(shape, dtype=dtype)
+    method_mask = np.zeros(shape[:3], dtype=bool)
+    feature_mask = np.zeros(shape[:2] + shape[3:], dtype=bool)
+    presence = np.zeros(shape, dtype=bool)
+    for p, mi, k, idx, vals in entries:
+        values[p, mi, k, idx] = vals
+        method_mask[p, mi, k] = True
+        feature_mask[p, mi, idx] = True
+        presence[p, mi, k, idx] = True
+
+    return make_cohort(patients, models, list(methods), features, values, method_mask, feature_mask, presence)
+
+
+def read_only(array):
+    """Read-only view of an array; the caller's own reference stays writable."""
+    if array is None:
+        return None
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def make_cohort(patients, models, methods, features, values, method_mask, feature_mask, presence):
+    # The arrays are shared by every analysis of the cohort (and by threads), so they are handed out read-only
+    return {
+        "patients": patients,
+        "models": models,
+        "methods": methods,
+        "features": features,
+        "patient_index": {name: i for i, name in enumerate(patients)},
+        "model_index": {model: i for i, model in enumerate(models)},
+        "method_index": {m: i for i, m in enumerate(methods)},
+        "feature_index": {f: i for i, f in enumerate(features)},
+        # values[patient, model, method, feature]; missing entries are 0 like methods_data[m].get(f, 0)
+        "values": read_only(values),
+        # method_mask[patient, model, method]: the method is present for that model in the patient file
+        "method_mask": read_only(method_mask),
+        # feature_mask[patient, model, feature]: the feature appears in at least one method of that model
+        "feature_mask": read_only(feature_mask),
+        # presence[patient, model, method, feature]: the method lists the feature, a listed 0 included
+        "presence": read_only(presence),
+    }
+
+
+def load_cohort(data_dir=DATA_DIR, methods=methods, dtype=np.float64, models=None, features=None):
+    """Load a directory; models/features select what is packed (the JSON files are still parsed whole)."""
+    return build_cohort(iter_patient_files(data_dir), methods, dtype, models, features)
+
+
+def _selection(names, index, selected):
+    missing = [name for name in selected if name not in index]
+    if missing:
+        raise KeyError(f"Not in the cohort: {missing}")
+    return [index[name] for name in selected]
+
+
+def slice_cohort(cohort, patients=None, models=None, methods=None, features=None):
+    """Sub-cohort for a patient slice/index list and/or lists of model, method and feature names.
+
+    A slice of patients keeps the arrays as views, so memory-mapped cohorts only read what is used; the name
+    selections are applied after it and copy only the selected part. For a method selection feature_mask is
+    recomputed from the selected methods' entries, as if only those methods had been loaded.
+    """
+    patient_sel = slice(None) if patients is None else patients
+    names = cohort["patients"][patient_sel] if isinstance(patient_sel, slice) \
+        else [cohort["patients"][p] for p in patient_sel]
+    values = cohort["values"][patient_sel]
+    method_mask = cohort["method_mask"][patient_sel]
+    feature_mask = cohort["feature_mask"][patient_sel]
+    presence = cohort["presence"][patient_sel]
+    model_names = cohort["models"]
+    method_names = cohort["methods"]
+    feature_names = cohort["features"]
+    if models is not None:
+        model_sel = _selection(model_names, cohort["model_index"], models)
+        values = values[:, model_sel]
+        method_mask = method_mask[:, model_sel]
+        feature_mask = feature_mask[:, model_sel]
+        presence = presence[:, model_sel]
+        model_names = list(models)
+    if methods is not None and list(methods) != list(method_names):
+        method_sel = _selection(method_names, cohort["method_index"], methods)
+        values = values[:, :, method_sel]
+        method_mask = method_mask[:, :, method_sel]
+        presence = presence[:, :, method_sel]
+        feature_mask = presence.any(axis=2)
+        method_names = list(methods)
+    if features is not None:
+        feature_sel = _selection(feature_names, cohort["feature_index"], features)
+        values = values[..., feature_sel]
+        feature_mask = feature_mask[..., feature_sel]
+        presence = presence[..., feature_sel]
+        feature_names = list(features)
+    return make_cohort(list(names), list(model_names), list(method_names), list(feature_names),
+                       values, method_mask, feature_mask, presence)
+
+
+def model_slice(cohort, model):
+    """Return (values, method_mask, feature_mask) for one model across all patients."""
+    mi = cohort["model_index"][model]
+    return cohort["values"][:, mi], cohort["method_mask"][:, mi], cohort["feature_mask"][:, mi]
+
+
+if __name__ == "__main__":
+    cohort = load_cohort(DATA_DIR)
+    print(f"✅ Loaded {len(cohort['patients'])} patients × {len(cohort['models'])} models × "
+          f"{len(cohort['methods'])} methods × {len(cohort['features'])} features from '{DATA_DIR}'.")
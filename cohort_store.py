@@ -0,0 +1,219 @@
+import os
+import json
+import struct
+import hashlib
+import argparse
+
+import numpy as np
+
+from cohort_loader import (DATA_DIR, build_cohort, iter_patient_files, list_patient_files, load_cohort, make_cohort,
+                           methods, slice_cohort)
+from parallel_driver import WORKERS, iter_parallel
+
+# File layout: MAGIC, little-endian uint64 header length, JSON header, then the values, method_mask,
+# feature_mask and presence arrays in C order, each starting on an ALIGN-byte boundary at the offset given in
+# the header. The last byte of MAGIC is the format version.
+MAGIC = b"XCOHORT2"
+ALIGN = 64
+ARRAYS = ("values", "method_mask", "feature_mask", "presence")
+STORE_SUFFIX = ".cohort"
+
+
+def is_store(path):
+    return os.path.isfile(path) and path.endswith(STORE_SUFFIX)
+
+
+def _align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def _layout(header):
+    P, M, K, F = header["shape"]
+    itemsize = np.dtype(header["dtype"]).itemsize
+    sizes = {"values": P * M * K * F * itemsize, "method_mask": P * M * K, "feature_mask": P * M * F,
+             "presence": P * M * K * F}
+
+    # The header's own length depends on the offsets it records; grow until it fits
+    offsets = {}
+    start = offset = 0
+    while True:
+        header["offsets"] = offsets
+        encoded = json.dumps(header).encode()
+        data_start = _align(len(MAGIC) + 8 + len(encoded))
+        if data_start == start:
+            return encoded, offset
+        start = data_start
+        offsets = {}
+        offset = start
+        for name in ARRAYS:
+            offsets[name] = offset
+            offset = _align(offset + sizes[name])
+
+
+def _create(path, patients, models, methods, features, dtype):
+    header = {
+        "dtype": np.dtype(dtype).str,
+        "shape": [len(patients), len(models), len(methods), len(features)],
+        "patients": patients,
+        "models": models,
+        "methods": methods,
+        "features": features,
+    }
+    encoded, end = _layout(header)
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+        f.truncate(end)
+    return header
+
+
+def _arrays(path, header, mode):
+    P, M, K, F = header["shape"]
+    offsets = header["offsets"]
+    return (
+        np.memmap(path, dtype=header["dtype"], mode=mode, offset=offsets["values"], shape=(P, M, K, F)),
+        np.memmap(path, dtype=bool, mode=mode, offset=offsets["method_mask"], shape=(P, M, K)),
+        np.memmap(path, dtype=bool, mode=mode, offset=offsets["feature_mask"], shape=(P, M, F)),
+        np.memmap(path, dtype=bool, mode=mode, offset=offsets["presence"], shape=(P, M, K, F)),
+    )
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic[:-1] == MAGIC[:-1] and magic != MAGIC:
+            raise ValueError(f"{path} was written in an older cohort store format; convert the directory again")
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a cohort store")
+        (length,) = struct.unpack("<Q", f.read(8))
+        return json.loads(f.read(length))
+
+
+def store_fingerprint(path):
+    """Size, modification time and header hash of a store; changes whenever the store is rewritten."""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        f.seek(len(MAGIC))
+        (length,) = struct.unpack("<Q", f.read(8))
+        header_digest = hashlib.sha256(f.read(length)).hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "header_sha256": header_digest}
+
+
+def save_cohort(cohort, path, dtype=None):
+    """Write an in-memory cohort (see cohort_loader.build_cohort) to a store file."""
+    dtype = cohort["values"].dtype if dtype is None else dtype
+    header = _create(path, cohort["patients"], cohort["models"], cohort["methods"], cohort["features"], dtype)
+    if not all(header["shape"]):
+        return path
+    arrays = _arrays(path, header, "r+")
+    for name, array in zip(ARRAYS, arrays):
+        array[:] = cohort[name]
+        array.flush()
+    return path
+
+
+def convert_directory(data_dir, path, methods=methods, dtype=np.float32, chunk_size=1000):
+    """Convert a directory of patient JSON files into a store without holding the whole cohort in memory.
+
+    A first pass collects the model/feature vocabulary; the second packs chunks of patients straight into
+    the memory-mapped file.
+    """
+    models = {}
+    features = set()
+    for _, data in iter_patient_files(data_dir):
+        for model, methods_data in data.items():
+            models.setdefault(model, None)
+            for m in methods:
+                features.update(methods_data.get(m, {}))
+    patients = list_patient_files(data_dir)
+    models = list(models)
+    features = sorted(features)
+
+    header = _create(path, patients, models, list(methods), features, dtype)
+    if not all(header["shape"]):
+        return path
+    arrays = _arrays(path, header, "r+")
+    records = iter_patient_files(data_dir)
+    for start in range(0, len(patients), chunk_size):
+        chunk = [next(records) for _ in range(min(chunk_size, len(patients) - start))]
+        cohort = build_cohort(chunk, methods, dtype, models=models, features=features)
+        for name, array in zip(ARRAYS, arrays):
+            array[start:start + len(chunk)] = cohort[name]
+    for array in arrays:
+        array.flush()
+    return path
+
+
+def open_cohort(path, models=None, methods=None, features=None):
+    """Open a store as a cohort dict whose arrays are read-only memory maps; slicing reads only what it touches.
+
+    models/methods/features select by name (see cohort_loader.slice_cohort); only the selected part is read.
+    """
+    header = read_header(path)
+    if all(header["shape"]):
+        values, method_mask, feature_mask, presence = _arrays(path, header, "r")
+    else:
+        P, M, K, F = header["shape"]
+        values = np.zeros((P, M, K, F), dtype=header["dtype"])
+        method_mask = np.zeros((P, M, K), dtype=bool)
+        feature_mask = np.zeros((P, M, F), dtype=bool)
+        presence = np.zeros((P, M, K, F), dtype=bool)
+    cohort = make_cohort(header["patients"], header["models"], header["methods"], header["features"],
+                         values, method_mask, feature_mask, presence)
+    if models is None and methods is None and features is None:
+        return cohort
+    return slice_cohort(cohort, models=models, methods=methods, features=features)
+
+
+
+def load_any_cohort(path, methods=None, models=None, features=None):
+    """Open a store (see open_cohort) or load a directory of patient JSON files (see cohort_loader.load_cohort).
+
+    models/methods/features select by name. Without methods a store keeps all of its methods and a directory
+    loads the default ones.
+    """
+    if is_store(path):
+        return open_cohort(path, models, methods, features)
+    if methods is None:
+        return load_cohort(path, models=models, features=features)
+    return load_cohort(path, methods, models=models, features=features)
+
+def load_store_patients(path, patient_indices, models=None, methods=None, features=None):
+    """Sub-cohort of a store for the given patient indices, optionally selecting models/methods/features.
+
+    Patients are selected first (a contiguous run stays a memory-mapped view), so a selection only reads the
+    chosen sections of those patients.
+    """
+    cohort = open_cohort(path)
+    if patient_indices and patient_indices[-1] - patient_indices[0] + 1 == len(patient_indices):
+        patients = slice(patient_indices[0], patient_indices[-1] + 1)
+    else:
+        patients = list(patient_indices)
+    return slice_cohort(cohort, patients, models, methods, features)
+
+
+def iter_store_patients(func, path, workers=WORKERS, chunksize=None, skip=()):
+    """Store counterpart of parallel_driver.iter_per_patient: func gets a list of patient indices per chunk."""
+    patients = read_header(path)["patients"]
+    indices = [p for p, name in enumerate(patients) if name not in skip]
+    yield from zip((patients[p] for p in indices), iter_parallel(func, indices, workers, chunksize, batched=True))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a directory of patient explanation JSON files into a "
+                                                 "memory-mapped cohort store.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output", help=f"store file (default: <data dir>{STORE_SUFFIX})")
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float32")
+    parser.add_argument("--methods", nargs="+", default=methods)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = args.output or os.path.normpath(args.data_dir) + STORE_SUFFIX
+    convert_directory(args.data_dir, output, args.methods, args.dtype)
+    print(f"✅ Cohort store written to '{output}' ({os.path.getsize(output) / 2 ** 20:.1f} MB).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import json
+import argparse
+
+import numpy as np
+
+from batch_metrics import batch_pearson_matrix, batch_sign_agreement
+from cohort_loader import model_slice
+from cohort_store import load_any_cohort
+from metrics_engine import method_pairs, rounded
+
+DATA_DIR = "patient_contributions_DataSet1"
+methods = ["SHAP", "Lime", "Inherent"]
+OUTPUT_FILE = "feature_agreement_DataSet1.json"
+
+
+def feature_agreement(values, method_mask, feature_mask, pairs):
+    """Cross-patient agreement for every feature of one model.
+
+    values is the model's (patients x methods x features) slice. Each feature becomes a row whose "features"
+    axis is the patients, so the batched kernels handle all features at once. A patient counts for a feature when
+    it has the feature and every method. Returns per-feature arrays:
+    pair_r (features x pairs): Pearson r between two methods' contributions across patients;
+    sign_agreement: share of patients where the non-zero methods agree on the sign (at least two non-zero);
+    sign_consistency (features x methods): share of patients whose sign is the method's majority sign;
+    n_patients.
+    """
+    rows = np.ascontiguousarray(values.transpose(2, 1, 0))
+    F, K, P = rows.shape
+    patient_mask = (feature_mask & method_mask.all(axis=1)[:, None]).T
+    all_methods = np.ones((F, K), dtype=bool)
+
+    r = batch_pearson_matrix(rows, patient_mask, all_methods)
+    pair_r = np.stack([r[:, i, j] for i, j in pairs], axis=1) if pairs else np.empty((F, 0))
+    sign_agreement = batch_sign_agreement(rows, patient_mask, all_methods)
+
+    cell_mask = patient_mask[:, None, :]
+    positive = ((rows > 0) & cell_mask).sum(axis=-1)
+    negative = ((rows < 0) & cell_mask).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sign_consistency = np.maximum(positive, negative) / (positive + negative)
+    return {"pair_r": pair_r, "sign_agreement": sign_agreement, "sign_consistency": sign_consistency,
+            "n_patients": patient_mask.sum(axis=1)}
+
+
+def feature_agreement_results(cohort):
+    method_index = cohort["method_index"]
+    named_pairs = method_pairs(cohort["methods"])
+    pairs = [(method_index[m1], method_index[m2]) for m1, m2 in named_pairs]
+    results = {}
+    for model in cohort["models"]:
+        values, method_mask, feature_mask = model_slice(cohort, model)
+        metrics = feature_agreement(values, method_mask, feature_mask, pairs)
+        model_result = {}
+        for fi, feature in enumerate(cohort["features"]):
+            n = int(metrics["n_patients"][fi])
+            if not n:
+                continue
+            entry = {"n_patients": n}
+            for c, (m1, m2) in enumerate(named_pairs):
+                entry[f"pearson_{m1}_vs_{m2}"] = rounded(metrics["pair_r"][fi, c])
+            entry["sign_agreement"] = rounded(metrics["sign_agreement"][fi])
+            entry["sign_consistency"] = {m: rounded(metrics["sign_consistency"][fi, k])
+                                         for k, m in enumerate(cohort["methods"])}
+            model_result[feature] = entry
+        results[model] = model_result
+    return results
+
+
+def run_feature_agreement(data_dir=DATA_DIR, output_file=OUTPUT_FILE, methods=methods, models=None):
+    cohort = load_any_cohort(data_dir, methods, models)
+    with open(output_file, 'w') as f:
+        json.dump(feature_agreement_results(cohort), f, indent=2)
+    return output_file
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-feature agreement between explanation methods across "
+                                                 "patients.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="patient JSON directory or .cohort store")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--methods", nargs="+", default=methods)
+    parser.add_argument("--models", nargs="+")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_file = run_feature_agreement(args.data_dir, args.output, args.methods, args.models)
+    print(f"✅ Analysis completed. Results saved to '{output_file}'.")
+
+
+if __name__ == "__main__":
+    main()
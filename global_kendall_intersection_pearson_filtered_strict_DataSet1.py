@@ -3,29 +3,24 @@ import json
 import numpy as np
 from scipy.stats import kendalltau
 
+from batch_metrics import kendalls_w_from_rank_matrix, rank_data
+from names import load_explanation
+
 # DATA_FILE = "./global_explanations_1/global_graph_data.json"
 DATA_FILE = "./global_explanations_2/global_graph_DataSet2.json"
 methods = ["SHAP", "Lime", "Inherent"]
 TOP_K = 10
 
-def kendalls_w_from_rank_matrix(rank_matrix):
-    rank_matrix = np.array(rank_matrix)
-    k, n = rank_matrix.shape
-    if k < 2 or n < 2:
-        return None
-    R = np.sum(rank_matrix, axis=0)
-    R_bar = np.mean(R)
-    S = np.sum((R - R_bar) ** 2)
-    W = 12 * S / (k ** 2 * (n ** 3 - n))
-    return W
+def thresholded(value, threshold):
+    return 0 if abs(value) < threshold else value
 
 
-def intersection_at_k(methods_data, features, k=TOP_K):
+def intersection_at_k(methods_data, features, k=TOP_K, threshold=0):
     top_k = {}
     for m in methods:
         if m in methods_data:
             sorted_feats = sorted(
-                [(f, methods_data[m].get(f, 0)) for f in features],
+                [(f, thresholded(methods_data[m].get(f, 0), threshold)) for f in features],
                 key=lambda x: abs(x[1]),
                 reverse=True
             )
@@ -49,8 +44,7 @@ def intersection_at_k(methods_data, features, k=TOP_K):
     return round(np.mean(scores), 4) if scores else None
 
 def process_file(filepath):
-    with open(filepath, 'r') as f:
-        data = json.load(f)
+    data = load_explanation(filepath)
     result = {}
 
     THRESHOLD = 1
@@ -59,13 +53,10 @@ def process_file(filepath):
         if len(available_methods) < 2:
             continue
 
-        # אפס פיצ'רים שערכם קטן מהסף בכל שיטה
+        # Values below the threshold are read as 0; the loaded data itself is left untouched
         all_features = set()
         for m in available_methods:
             all_features.update(methods_data[m].keys())
-            for f in methods_data[m]:
-                if abs(methods_data[m][f]) < THRESHOLD:
-                    methods_data[m][f] = 0
 
         all_features_sorted = sorted(all_features)
         if not all_features_sorted:
@@ -74,7 +65,7 @@ def process_file(filepath):
         # מציאת פיצ'רים משותפים שאינם אפס בכל השיטות
         common_features = set(all_features_sorted)
         for m in available_methods:
-            nonzero_feats = {f for f in all_features_sorted if methods_data[m].get(f, 0) != 0}
+            nonzero_feats = {f for f in all_features_sorted if thresholded(methods_data[m].get(f, 0), THRESHOLD) != 0}
             common_features &= nonzero_feats
 
         common_features = sorted(common_features)
@@ -85,7 +76,7 @@ def process_file(filepath):
         aligned_ranks = []
         for m in available_methods:
             scores = [methods_data[m].get(f, 0) for f in common_features]
-            ranks = (-np.array(scores)).argsort().argsort() + 1
+            ranks = rank_data(scores)
             aligned_ranks.append(ranks)
 
         model_result = {}
@@ -94,15 +85,15 @@ def process_file(filepath):
         #     W = max(0.0, min(1.0, W))  # חסום לטווח חוקי
         model_result["kendall_w"] = round(W, 4) if W is not None else None
 
-        intersection_score = intersection_at_k(methods_data, all_features_sorted, TOP_K)
+        intersection_score = intersection_at_k(methods_data, all_features_sorted, TOP_K, THRESHOLD)
         model_result[f"intersection_at_{TOP_K}"] = intersection_score
 
         # Pearson correlation average (on raw values)
         pearson_scores = []
         for m1, m2 in [("SHAP", "Lime"), ("SHAP", "Inherent"), ("Lime", "Inherent")]:
             if m1 in methods_data and m2 in methods_data:
-                v1 = np.array([methods_data[m1].get(f, 0) for f in all_features_sorted])
-                v2 = np.array([methods_data[m2].get(f, 0) for f in all_features_sorted])
+                v1 = np.array([thresholded(methods_data[m1].get(f, 0), THRESHOLD) for f in all_features_sorted])
+                v2 = np.array([thresholded(methods_data[m2].get(f, 0), THRESHOLD) for f in all_features_sorted])
                 if len(v1) > 1:
                     r = np.corrcoef(v1, v2)[0, 1]
                     pearson_scores.append(r)
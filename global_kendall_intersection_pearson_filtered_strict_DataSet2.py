@@ -3,21 +3,13 @@ import json
 import numpy as np
 from scipy.stats import kendalltau
 
+from batch_metrics import kendalls_w_from_rank_matrix, rank_data
+from names import load_explanation
+
 DATA_FILE = "./global_explanations_2/global_graph_DataSet2.json"
 methods = ["SHAP", "Lime", "Inherent"]
 TOP_K = 10
 
-def kendalls_w_from_rank_matrix(rank_matrix):
-    rank_matrix = np.array(rank_matrix)
-    k, n = rank_matrix.shape
-    if k < 2 or n < 2:
-        return None
-    R = np.sum(rank_matrix, axis=0)
-    R_bar = np.mean(R)
-    S = np.sum((R - R_bar) ** 2)
-    W = 12 * S / (k ** 2 * (n ** 3 - n))
-    return W
-
 def intersection_at_k(methods_data, features, k=TOP_K):
     top_k = {}
     for m in methods:
@@ -45,8 +37,7 @@ def format_metric(name, score):
     return { "name": name, "agreement": agreement, "disagreement": disagreement }
 
 def process_file(filepath):
-    with open(filepath, 'r') as f:
-        data = json.load(f)
+    data = load_explanation(filepath)
     result = {}
 
     for model, methods_data in data.items():
@@ -70,7 +61,7 @@ def process_file(filepath):
 
         for m in available_methods:
             scores = [methods_data[m].get(f, 0) for f in features]
-            ranks = (-np.array(scores)).argsort().argsort() + 1
+            ranks = rank_data(scores)
             method_ranks.append(ranks)
 
         metrics = []
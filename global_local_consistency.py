@@ -0,0 +1,127 @@
+import json
+import argparse
+
+import numpy as np
+
+from batch_metrics import batch_intersection_at_k, batch_pearson_matrix, rank_data
+from cohort_loader import slice_cohort
+from cohort_store import load_any_cohort
+from metrics_engine import rounded
+from names import load_explanation
+
+DATA_DIR = "patient_contributions_DataSet1"
+GLOBAL_FILE = "./global_explanations_1/global_graph_data.json"
+# GLOBAL_FILE = "./global_explanations_2/global_graph_DataSet2.json"
+TOP_K = [5, 10]
+OUTPUT_FILE = "global_local_consistency_DataSet1.json"
+# Patients per vectorized block; bounds the (patients x models x methods x 2 x features) working tensor
+CHUNK_PATIENTS = 2000
+
+
+def load_global(path, cohort):
+    """Global explanation aligned to the cohort's (model, method, feature) axes, with its presence mask.
+
+    Model and method names are normalized ("XGBoost" -> "XGBOOST", "LIME" -> "Lime"); features the
+    per-patient files do not have are dropped.
+    """
+    data = load_explanation(path)
+    shape = (len(cohort["models"]), len(cohort["methods"]), len(cohort["features"]))
+    values = np.zeros(shape)
+    mask = np.zeros(shape, dtype=bool)
+    for model, methods_data in data.items():
+        mi = cohort["model_index"].get(model)
+        if mi is None:
+            continue
+        for m, feature_values in methods_data.items():
+            k = cohort["method_index"].get(m)
+            if k is None:
+                continue
+            for f, v in feature_values.items():
+                fi = cohort["feature_index"].get(f)
+                if fi is not None:
+                    values[mi, k, fi] = v
+                    mask[mi, k, fi] = True
+    return values, mask
+
+
+def compute_consistency(cohort, global_values, global_mask, k_values=TOP_K):
+    """Agreement of every patient's |contribution| with the global importance, per (patient, model, method).
+
+    Returns (P, M, K) arrays "spearman" and "pearson" plus (P, M, K, len(k_values)) "intersection";
+    NaN where the patient and the global explanation share fewer than two features.
+    """
+    values = cohort["values"]
+    P, M, K, F = values.shape
+    N = P * M * K
+    # The global files hold mean |contribution|, so patients are compared on magnitude
+    local = np.abs(values)
+    reference = np.broadcast_to(np.abs(global_values), local.shape)
+    pair = np.stack([local, reference], axis=3).reshape(N, 2, F)
+    mask = (cohort["feature_mask"][:, :, None, :] & cohort["method_mask"][..., None] & global_mask).reshape(N, F)
+    valid = mask.sum(axis=1) >= 2
+
+    pearson = batch_pearson_matrix(pair, mask)[:, 0, 1]
+    spearman = batch_pearson_matrix(rank_data(pair, mask[:, None, :]), mask)[:, 0, 1]
+    intersection = batch_intersection_at_k(pair, mask, np.ones((N, 2), dtype=bool), k_values, [(0, 1)])
+
+    metrics = {"spearman": spearman, "pearson": pearson, "intersection": intersection}
+    for array in metrics.values():
+        array[~valid] = np.nan
+    return {name: array.reshape((P, M, K) + array.shape[1:]) for name, array in metrics.items()}
+
+
+def _metric_columns(metrics):
+    # (P, M, K, metric) in the order spearman, pearson, intersection_at_{k}...
+    return np.concatenate([metrics["spearman"][..., None], metrics["pearson"][..., None], metrics["intersection"]],
+                          axis=-1)
+
+
+def run_consistency(data_dir=DATA_DIR, global_file=GLOBAL_FILE, k_values=TOP_K, output_file=OUTPUT_FILE):
+    cohort = load_any_cohort(data_dir)
+    global_values, global_mask = load_global(global_file, cohort)
+    names = ["spearman", "pearson"] + [f"intersection_at_{k}" for k in k_values]
+    totals = np.zeros((len(cohort["models"]), len(cohort["methods"]), len(names)))
+    counts = np.zeros(totals.shape)
+
+    patients = {}
+    for start in range(0, len(cohort["patients"]), CHUNK_PATIENTS):
+        chunk = slice_cohort(cohort, slice(start, start + CHUNK_PATIENTS))
+        columns = _metric_columns(compute_consistency(chunk, global_values, global_mask, k_values))
+        observed = ~np.isnan(columns)
+        totals += np.where(observed, columns, 0).sum(axis=0)
+        counts += observed.sum(axis=0)
+        for p, patient in enumerate(chunk["patients"]):
+            patient_result = {}
+            for mi, model in enumerate(chunk["models"]):
+                model_result = {m: dict(zip(names, map(rounded, columns[p, mi, k])))
+                                for k, m in enumerate(chunk["methods"]) if chunk["method_mask"][p, mi, k]}
+                if model_result:
+                    patient_result[model] = model_result
+            patients[patient] = patient_result
+
+    with np.errstate(invalid="ignore"):
+        means = totals / counts
+    summary = {model: {m: dict(zip(names, map(rounded, means[mi, k]))) for k, m in enumerate(cohort["methods"])}
+               for mi, model in enumerate(cohort["models"]) if global_mask[mi].any()}
+    with open(output_file, 'w') as f:
+        json.dump({"global_file": global_file, "summary": summary, "patients": patients}, f, indent=2)
+    return output_file
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Agreement of each patient's explanation with the global one.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="patient JSON directory or .cohort store")
+    parser.add_argument("--global-file", default=GLOBAL_FILE)
+    parser.add_argument("--top-k", nargs="+", type=int, default=TOP_K)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_file = run_consistency(args.data_dir, args.global_file, args.top_k, args.output)
+    print(f"✅ Analysis completed. Results saved to '{output_file}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,16 @@
 
-import os
 import json
 import numpy as np
 from scipy.stats import kendalltau
 
+from batch_metrics import kendalls_w_from_rank_matrix, rank_data
+from cohort_loader import iter_patient_files
+from names import load_explanation
+
 DATA_DIR = "patient_contributions_DataSet1"
 methods = ["SHAP", "Lime", "Inherent"]
 TOP_K = 5
 
-def kendalls_w_from_rank_matrix(rank_matrix):
-    rank_matrix = np.array(rank_matrix)
-    k, n = rank_matrix.shape
-    if k < 2 or n < 2:
-        return None
-    R = np.sum(rank_matrix, axis=0)
-    R_bar = np.mean(R)
-    S = np.sum((R - R_bar) ** 2)
-    W = 12 * S / (k ** 2 * (n ** 3 - n))
-    return W
-
 def sign_agreement(methods_data):
     signs_by_method = {}
     features = set()
@@ -56,8 +48,9 @@ def intersection_at_k(methods_data, k=TOP_K):
     return round(np.mean(scores), 4) if scores else None
 
 def process_file(filepath):
-    with open(filepath, 'r') as f:
-        data = json.load(f)
+    return process_explanation(load_explanation(filepath))
+
+def process_explanation(data):
     result = {}
 
     for model, methods_data in data.items():
@@ -73,7 +66,7 @@ def process_file(filepath):
 
         for m in available_methods:
             scores = [methods_data[m].get(f, 0) for f in features]
-            ranks = (-np.array(scores)).argsort().argsort() + 1
+            ranks = rank_data(scores)
             method_ranks.append(ranks)
 
         model_result = {}
@@ -106,11 +99,9 @@ def process_file(filepath):
 
 def main():
     results = {}
-    for filename in os.listdir(DATA_DIR):
-        if filename.endswith(".json"):
-            filepath = os.path.join(DATA_DIR, filename)
-            patient_result = process_file(filepath)
-            results[filename] = patient_result
+    # Files are parsed on a prefetching thread pool while the previous patient is processed
+    for filename, data in iter_patient_files(DATA_DIR):
+        results[filename] = process_explanation(data)
 
     with open("kendall_sign_intersection.json", "w") as f:
         json.dump(results, f, indent=2)
@@ -0,0 +1,320 @@
+import os
+import argparse
+from functools import partial
+
+import numpy as np
+
+from aggregate_metrics import aggregate_file
+from batch_metrics import (batch_intersection_at_k, batch_kendall_tau_pairs, batch_kendalls_w, batch_pearson_avg,
+                           batch_sign_agreement)
+from cohort_loader import build_cohort
+from cohort_store import is_store, iter_store_patients, load_store_patients, read_header, store_fingerprint
+from null_distributions import batch_p_values, tied_kendall_w_p_values
+from ndjson_io import close_stream, ndjson_to_json, open_stream, write_record
+from parallel_driver import WORKERS, iter_per_patient
+from prefetch_loader import PREFETCH_THREADS, process_in_blocks, worker_threads
+from result_cache import cached_iter_per_patient, code_version
+from sparse_cohort import build_sparse_cohort, compact_common, to_sparse
+
+DATA_DIR = "patient_contributions_DataSet1"
+methods = ["SHAP", "Lime", "Inherent"]
+PAIRS = [("SHAP", "Lime"), ("SHAP", "Inherent"), ("Lime", "Inherent")]
+
+DEFAULT_CONFIG = {
+    "methods": methods,
+    # Models to analyse (None = every model in the data); the others are never packed into the cohort
+    "models": None,
+    "top_k": [5],
+    # Values with abs(v) < threshold are treated as 0 (0 keeps everything)
+    "threshold": 0,
+    # "ignore": drop zero signs, count features with >= 2 non-zero signs; "skip": drop features with any zero
+    "zero_policy": "ignore",
+    # Features that sign agreement, intersection@K and Pearson run on: "common" (non-zero in every method)
+    # or "all" (every feature of the model). Kendall's W always ranks the common features.
+    "feature_scope": "common",
+    # Models with fewer common features than this are left out of the patient's result
+    "min_common": 1,
+    # Pearson r of a constant explanation: "nan" (reported as NaN/null) or "zero"
+    "constant_policy": "nan",
+    # "sparse" keeps only the values that survive the threshold (CSR rows) and computes the metrics on each
+    # model's common features; it needs the "common" feature scope
+    "representation": "dense",
+    # Random-ranking draws behind the kendall_w_p / intersection_at_{K}_p permutation p-values (0 = off)
+    "significance_draws": 0,
+}
+
+PRESETS = {
+    # kendall_sign_intersection_pearson_filtered_strict_DataSet1.py
+    "DataSet1": dict(DEFAULT_CONFIG),
+    # kendall_sign_intersection_pearson_filtered_strict_DataSet2.py
+    "DataSet2": dict(DEFAULT_CONFIG, top_k=[10], threshold=1, zero_policy="skip", feature_scope="all", min_common=2),
+}
+
+
+def method_pairs(method_names):
+    return [(m1, m2) for m1, m2 in PAIRS if m1 in method_names and m2 in method_names]
+
+
+def flat_arrays(cohort):
+    """(values, method_mask, feature_mask) with patients and models merged into one row axis."""
+    P, M, K, F = cohort["values"].shape
+    return (cohort["values"].reshape(P * M, K, F), cohort["method_mask"].reshape(P * M, K),
+            cohort["feature_mask"].reshape(P * M, F))
+
+
+def metric_arrays(values, method_mask, common_mask, scope_mask, pairs, config):
+    """Every metric for (rows x methods x features) values, as (rows, ...) arrays.
+
+    The values are only read: config["threshold"] is applied inside the kernels, and W and tau only see the
+    common features, which the threshold leaves unchanged. One tensor can therefore feed any number of
+    configs, including from several threads.
+    """
+    threshold = config["threshold"]
+    n_common = common_mask.sum(axis=1)
+    pearson_avg, pearson_r, pearson_pairs = batch_pearson_avg(values, scope_mask, method_mask, pairs,
+                                                              config["constant_policy"], threshold)
+    metrics = {
+        "valid": (method_mask.sum(axis=1) >= 2) & (n_common >= max(config["min_common"], 1)),
+        "kendall_w": batch_kendalls_w(values, common_mask, method_mask),
+        # Pairwise tau-b on the same common features as W, to show which method pair drives the disagreement
+        "kendall_tau": batch_kendall_tau_pairs(values, common_mask, method_mask, pairs),
+        "sign_agreement": batch_sign_agreement(values, scope_mask, method_mask, config["zero_policy"], threshold),
+        "intersection": batch_intersection_at_k(values, scope_mask, method_mask, config["top_k"], pairs,
+                                                threshold),
+        "pearson_avg": pearson_avg,
+        "pearson_r": pearson_r,
+        "pearson_pairs": pearson_pairs,
+    }
+    draws = config["significance_draws"]
+    if draws:
+        # Null distributions depend only on (methods, features), so patients with equal counts share one set
+        # of random rankings, and W and every K are read from it
+        k_eff = method_mask.sum(axis=1)
+        n_scope = scope_mask.sum(axis=1)
+        observed = {"kendall_w": (metrics["kendall_w"], n_common)}
+        for c, k in enumerate(config["top_k"]):
+            observed[f"intersection_at_{k}"] = (metrics["intersection"][:, c], n_scope)
+        p = batch_p_values(observed, k_eff, draws=draws)
+        # The shared nulls are untied; rows whose ranks tie get a permutation null of their own ranks instead
+        metrics["kendall_w_p"] = tied_kendall_w_p_values(values, common_mask, method_mask, metrics["kendall_w"],
+                                                         p["kendall_w"], draws=draws)
+        metrics["intersection_p"] = np.stack([p[f"intersection_at_{k}"] for k in config["top_k"]], axis=1)
+    return metrics
+
+
+def common_features(values, method_mask, threshold=0):
+    """(rows x features) mask of features that every present method has non-zero, after the threshold."""
+    kept = values != 0
+    if threshold:
+        kept &= ~(np.abs(values) < threshold)
+    return (kept | ~method_mask[..., None]).all(axis=1)
+
+
+def pair_indices(cohort):
+    method_index = cohort["method_index"]
+    return [(method_index[m1], method_index[m2]) for m1, m2 in method_pairs(cohort["methods"])]
+
+
+def compute_metrics(cohort, config):
+    """All per-(patient, model) metrics for one config, as (patients x models) arrays."""
+    P, M = cohort["method_mask"].shape[:2]
+    values, method_mask, feature_mask = flat_arrays(cohort)
+
+    common_mask = feature_mask & common_features(values, method_mask, config["threshold"])
+    scope_mask = common_mask if config["feature_scope"] == "common" else feature_mask
+
+    metrics = metric_arrays(values, method_mask, common_mask, scope_mask, pair_indices(cohort), config)
+    return {name: array.reshape((P, M) + array.shape[1:]) for name, array in metrics.items()}
+
+
+def rounded(value):
+    """A metric value as written to the results: 4 decimals, None for NaN."""
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+def metrics_to_results(cohort, metrics, config):
+    named_pairs = method_pairs(cohort["methods"])
+    pair_names = [f"pearson_{m1}_vs_{m2}" for m1, m2 in named_pairs]
+    tau_names = [f"kendall_tau_{m1}_vs_{m2}" for m1, m2 in named_pairs]
+    results = []
+    for p in range(len(cohort["patients"])):
+        patient_result = {}
+        for mi, model in enumerate(cohort["models"]):
+            if not metrics["valid"][p, mi]:
+                continue
+            model_result = {
+                "kendall_w": rounded(metrics["kendall_w"][p, mi]),
+            }
+            if "kendall_w_p" in metrics:
+                model_result["kendall_w_p"] = rounded(metrics["kendall_w_p"][p, mi])
+            for c, name in enumerate(tau_names):
+                model_result[name] = rounded(metrics["kendall_tau"][p, mi, c])
+            model_result["sign_agreement"] = rounded(metrics["sign_agreement"][p, mi])
+            for c, k in enumerate(config["top_k"]):
+                model_result[f"intersection_at_{k}"] = rounded(metrics["intersection"][p, mi, c])
+                if "intersection_p" in metrics:
+                    model_result[f"intersection_at_{k}_p"] = rounded(metrics["intersection_p"][p, mi, c])
+            if metrics["pearson_pairs"][p, mi]:
+                # NaN (a constant explanation) is kept as NaN, as np.corrcoef reported it
+                model_result["pearson_avg"] = round(float(metrics["pearson_avg"][p, mi]), 4)
+                for c, name in enumerate(pair_names):
+                    model_result[name] = rounded(metrics["pearson_r"][p, mi, c])
+            patient_result[model] = model_result
+        results.append(patient_result)
+    return results
+
+
+def process_cohort(cohort, config):
+    if "indptr" in cohort:
+        if config["feature_scope"] != "common":
+            raise ValueError("The sparse representation only stores non-zero values; it needs feature_scope "
+                             "'common'")
+        compact = compact_common(cohort)
+        if not len(compact["features"]):
+            # No (patient, model) has a common feature, so none has a result
+            return [{} for _ in cohort["patients"]]
+        # The threshold was applied when the sparse cohort was built
+        metrics = compute_metrics(compact, dict(config, threshold=0))
+        return metrics_to_results(cohort, metrics, config)
+    return metrics_to_results(cohort, compute_metrics(cohort, config), config)
+
+
+def process_records(records, config):
+    if config["representation"] == "sparse":
+        cohort = build_sparse_cohort(records, config["methods"], config["threshold"], models=config["models"])
+    else:
+        cohort = build_cohort(records, config["methods"], models=config["models"])
+    return process_cohort(cohort, config)
+
+
+def process_files(filepaths, config, threads=PREFETCH_THREADS):
+    return process_in_blocks(partial(process_records, config=config), filepaths, threads=threads)
+
+
+def process_store_patients(patient_indices, path, config):
+    stored = read_header(path)
+    missing = [m for m in config["methods"] if m not in stored["methods"]]
+    if missing:
+        raise ValueError(f"{path} was built for methods {stored['methods']}, which lack {missing}")
+    # A store holds every model, including ones absent from some patients; a selection keeps the ones it has
+    models = None if config["models"] is None else [m for m in config["models"] if m in stored["models"]]
+    cohort = load_store_patients(path, patient_indices, models, config["methods"])
+    if config["representation"] == "sparse":
+        cohort = to_sparse(cohort, config["threshold"])
+    return process_cohort(cohort, config)
+
+
+def process_file(filepath, config=DEFAULT_CONFIG):
+    return process_files([filepath], config)[0]
+
+
+def run(config, data_dir=DATA_DIR, output_file=None, workers=WORKERS, use_cache=True, averages_file=None,
+        summary_file=None):
+    config = validate_config(dict(DEFAULT_CONFIG, **config))
+    if output_file is None:
+        output_file = f"metrics_{os.path.splitext(os.path.basename(os.path.normpath(data_dir)))[0]}.json"
+    stream_file = os.path.splitext(output_file)[0] + ".ndjson"
+    func = partial(process_files, config=config, threads=worker_threads(workers))
+
+    version = code_version(__name__, "batch_metrics", "cohort_loader", "names", "null_distributions", "prefetch_loader",
+                           "sparse_cohort")
+    header = {"config": config, "data_dir": data_dir, "code_version": version}
+    if is_store(data_dir):
+        # A reconverted store keeps its path, so the header also records which conversion the records came from
+        header["store"] = store_fingerprint(data_dir)
+    # A stream left by a run with another config, data directory or store is started over, not resumed
+    stream, done = open_stream(stream_file, header=header)
+    if is_store(data_dir):
+        # A binary cohort store is sliced by patient directly; there is no per-file content to cache
+        store_func = partial(process_store_patients, path=data_dir, config=config)
+        patient_results = iter_store_patients(store_func, data_dir, workers, skip=done)
+    elif use_cache:
+        patient_results = cached_iter_per_patient(func, data_dir, config, version,
+                                                  workers=workers, batched=True, skip=done)
+    else:
+        patient_results = iter_per_patient(func, data_dir, workers, batched=True, skip=done)
+    for filename, patient_result in patient_results:
+        write_record(stream, {"patient": filename, "result": patient_result})
+    close_stream(stream)
+
+    ndjson_to_json(stream_file, output_file)
+    if averages_file:
+        # The running state next to the stream lets the next run fold only patients that were added
+        aggregate_file(stream_file, averages_file, summary_file, state_file=stream_file + ".state")
+    return output_file
+
+
+def k_range(token):
+    """One CLI K value or inclusive range ("5", "1-50") as a list of ints; argparse type for --top-k."""
+    start, _, stop = token.partition("-")
+    try:
+        start, stop = int(start), int(stop or start)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a K value or range: {token!r}") from None
+    if start < 1:
+        raise argparse.ArgumentTypeError(f"K must be at least 1: {token!r}")
+    if stop < start:
+        raise argparse.ArgumentTypeError(f"empty K range (stop < start): {token!r}")
+    return list(range(start, stop + 1))
+
+
+def parse_k_values(tokens):
+    """Expand CLI K values such as ["5", "10"] or ["1-50"] into a sorted list of ints."""
+    return sorted(set().union(*map(k_range, tokens)))
+
+
+def validate_config(config):
+    """Reject settings the kernels would silently turn into NaN/inf or an empty result."""
+    top_k = config["top_k"]
+    if not isinstance(top_k, (list, tuple)) or not top_k:
+        raise ValueError(f"top_k must be a non-empty list of K values, got {top_k!r}")
+    for k in top_k:
+        if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+            raise ValueError(f"top_k values must be integers >= 1, got {k!r}")
+    for key, allowed in (("zero_policy", ("ignore", "skip")), ("feature_scope", ("common", "all")),
+                         ("constant_policy", ("nan", "zero")), ("representation", ("dense", "sparse"))):
+        if config[key] not in allowed:
+            raise ValueError(f"{key} must be one of {allowed}, got {config[key]!r}")
+    return config
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-patient agreement metrics between explanation methods.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), help="start from one of the strict script configs")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="patient JSON directory or .cohort store")
+    parser.add_argument("--output", help="output JSON file (default: metrics_<data dir>.json)")
+    parser.add_argument("--models", nargs="+", help="only analyse these models")
+    parser.add_argument("--methods", nargs="+")
+    parser.add_argument("--top-k", nargs="+", type=k_range, help="K values or ranges, e.g. 5 10 or 1-50")
+    parser.add_argument("--threshold", type=float)
+    parser.add_argument("--zero-policy", choices=["ignore", "skip"])
+    parser.add_argument("--feature-scope", choices=["common", "all"])
+    parser.add_argument("--min-common", type=int)
+    parser.add_argument("--constant-policy", choices=["nan", "zero"])
+    parser.add_argument("--representation", choices=["dense", "sparse"],
+                        help="sparse: store only values that survive the threshold (needs --feature-scope common)")
+    parser.add_argument("--significance-draws", type=int, help="add permutation p-values from this many draws")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--averages", help="also write per-model metric means here (average_metrics_per_model style)")
+    parser.add_argument("--summary", help="with --averages, also write count/std/quantiles per model and metric")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = dict(PRESETS[args.preset]) if args.preset else dict(DEFAULT_CONFIG)
+    if args.top_k is not None:
+        config["top_k"] = sorted(set().union(*args.top_k))
+    for key in ("models", "methods", "threshold", "zero_policy", "feature_scope", "min_common", "constant_policy",
+                "representation", "significance_draws"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+
+    output_file = run(config, args.data_dir, args.output, args.workers, use_cache=not args.no_cache,
+                      averages_file=args.averages, summary_file=args.summary)
+    print(f"✅ Analysis completed. Results saved to '{output_file}'.")
+
+
+if __name__ == "__main__":
+    main()
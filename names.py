@@ -0,0 +1,83 @@
+import json
+from functools import lru_cache
+
+# Canonical names are the ones the per-patient explanation files use. The global explanation files spell them
+# "LIME" and "XGBoost", so a script that looks sections up by canonical name (methods = ["SHAP", "Lime", ...])
+# only finds them in a file read with load_explanation.
+MODEL_ALIASES = {
+    "logisticregression": "LogisticRegression",
+    "decisiontree": "DecisionTree",
+    "xgboost": "XGBOOST",
+}
+METHOD_ALIASES = {
+    "shap": "SHAP",
+    "lime": "Lime",
+    "inherent": "Inherent",
+}
+
+
+def _key(name):
+    return "".join(c for c in name.lower() if c.isalnum())
+
+
+# Each distinct spelling is resolved once; every later file hits the cache
+@lru_cache(maxsize=None)
+def normalize_model(name):
+    """"XGBoost" / "Logistic Regression" -> "XGBOOST" / "LogisticRegression"; unknown names are kept."""
+    return MODEL_ALIASES.get(_key(name), name)
+
+
+@lru_cache(maxsize=None)
+def normalize_method(name):
+    return METHOD_ALIASES.get(_key(name), name)
+
+
+@lru_cache(maxsize=None)
+def normalize_feature(name):
+    return name.strip()
+
+
+def validate_explanation(data, source="explanation"):
+    """Check the {model: {method: {feature: value}}} nesting; raises ValueError naming the offending entry.
+
+    Values are not checked here: packing them into arrays (cohort_loader.build_cohort) rejects non-numbers.
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"{source}: expected an object of models, got {type(data).__name__}")
+    for model, methods_data in data.items():
+        if not isinstance(methods_data, dict):
+            raise ValueError(f"{source}: model '{model}' should map methods to features, "
+                             f"got {type(methods_data).__name__}")
+        for m, feature_values in methods_data.items():
+            if not isinstance(feature_values, dict):
+                raise ValueError(f"{source}: '{model}/{m}' should map features to values, "
+                                 f"got {type(feature_values).__name__}")
+    return data
+
+
+def _renamed(items, normalize, source):
+    renamed = {}
+    for name, value in items:
+        canonical = normalize(name)
+        if canonical in renamed:
+            raise ValueError(f"{source}: '{name}' duplicates another entry named '{canonical}'")
+        renamed[canonical] = value
+    return renamed
+
+
+def normalize_explanation(data, source="explanation"):
+    """Rename the model and method keys of a {model: {method: {feature: value}}} explanation.
+
+    Two spellings of the same name in one file (e.g. "LIME" and "Lime") raise ValueError instead of one
+    silently replacing the other.
+    """
+    models = _renamed(data.items(), normalize_model, source)
+    return {model: _renamed(methods_data.items(), normalize_method, f"{source}/{model}")
+            for model, methods_data in models.items()}
+
+
+def load_explanation(path):
+    """Read, validate and canonicalise one explanation file."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return normalize_explanation(validate_explanation(data, path), path)
@@ -0,0 +1,84 @@
+import os
+import json
+
+# Last line of a stream whose run finished; a stream without it can be resumed
+COMPLETE_MARKER = {"complete": True}
+
+
+def _valid_records(path):
+    """Yield (record, end_offset) for each fully written line, stopping at a truncated or corrupt tail."""
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                return
+            offset += len(line)
+            yield record, offset
+
+
+def read_ndjson(path):
+    for record, _ in _valid_records(path):
+        if record != COMPLETE_MARKER and "header" not in record:
+            yield record
+
+
+def is_complete(path):
+    last = None
+    for last, _ in _valid_records(path):
+        pass
+    return last == COMPLETE_MARKER
+
+
+def open_stream(path, key="patient", header=None):
+    """Open an NDJSON results stream for writing.
+
+    If a previous run with the same header left an unfinished stream, any partially written line is cut off
+    and the stream is reopened for appending. Returns (file, done), where done is the set of keys already written.
+    """
+    header = {"header": header}
+    done = set()
+    if os.path.exists(path) and not is_complete(path):
+        records = _valid_records(path)
+        first = next(records, (None, 0))
+        if first[0] == header:
+            end = first[1]
+            for record, end in records:
+                done.add(record[key])
+            records.close()
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+            return open(path, 'a'), done
+        records.close()
+
+    stream = open(path, 'w')
+    write_record(stream, header)
+    return stream, done
+
+
+def write_record(stream, record):
+    stream.write(json.dumps(record) + "\n")
+    # Flush every record so a crash loses at most the line being written
+    stream.flush()
+
+
+def close_stream(stream):
+    write_record(stream, COMPLETE_MARKER)
+    stream.close()
+
+
+def ndjson_to_json(ndjson_path, json_path, key="patient", value="result"):
+    """Write the {key: value} JSON object the scripts used to json.dump, one record at a time."""
+    seen = set()
+    with open(json_path, 'w') as out:
+        out.write("{")
+        for record in read_ndjson(ndjson_path):
+            if record[key] in seen:
+                continue
+            body = json.dumps(record[value], indent=2).replace("\n", "\n  ")
+            out.write(("\n" if not seen else ",\n") + f"  {json.dumps(record[key])}: {body}")
+            seen.add(record[key])
+        out.write("\n}" if seen else "}")
@@ -0,0 +1,163 @@
+import os
+import itertools
+
+import numpy as np
+
+from batch_metrics import rank_data
+from result_cache import CACHE_DIR
+
+NULL_DRAWS = 10000
+# Upper bound on the (draws x methods x features) block simulated at once
+BLOCK_SIZE = 1 << 22
+
+# In-process cache of sorted null samples, keyed by (statistic, k, n, draws, seed)
+_NULLS = {}
+
+
+def _random_ranks(rng, size, k, n):
+    # argsort of uniform noise is a uniformly random permutation, i.e. one random explanation ranking
+    return rng.random((size, k, n)).argsort(axis=-1) + 1
+
+
+def _w_statistic(ranks):
+    _, k, n = ranks.shape
+    R = ranks.sum(axis=1)
+    S = ((R - k * (n + 1) / 2) ** 2).sum(axis=-1)
+    return 12 * S / (k ** 2 * (n ** 3 - n))
+
+
+def _intersection_statistics(ranks, k_values):
+    """Mean pairwise intersection@K for every K in k_values, from one set of rankings."""
+    size, k, n = ranks.shape
+    pairs = list(itertools.combinations(range(k), 2))
+    # A feature is in both top-Ks exactly when the larger of its two ranks is <= K, so a cumulative histogram
+    # of those maxima gives the overlap at every K at once
+    larger = np.stack([np.maximum(ranks[:, i], ranks[:, j]) for i, j in pairs], axis=1)
+    offsets = np.arange(size * len(pairs))[:, None] * (n + 1)
+    counts = np.bincount((larger.reshape(-1, n) + offsets).ravel(), minlength=size * len(pairs) * (n + 1))
+    overlap = counts.reshape(size, len(pairs), n + 1).cumsum(axis=-1).sum(axis=1)
+    k_values = np.asarray(k_values)
+    return overlap[:, np.minimum(k_values, n)] / (k_values * len(pairs))
+
+
+def _statistic_name(metric, K=0):
+    return "kendall_w" if metric == "kendall_w" else f"intersection_at_{K}"
+
+
+def _simulate(statistics, k, n, draws, seed):
+    """Sorted nulls of the named statistics, all read from the same `draws` random rankings."""
+    rng = np.random.default_rng(np.random.SeedSequence([seed, k, n]))
+    k_values = [int(name.rsplit("_", 1)[1]) for name in statistics if name != "kendall_w"]
+    block = max(1, BLOCK_SIZE // max(k * n, 1))
+    samples = {name: [] for name in statistics}
+    for start in range(0, draws, block):
+        ranks = _random_ranks(rng, min(block, draws - start), k, n)
+        if "kendall_w" in samples:
+            samples["kendall_w"].append(_w_statistic(ranks))
+        if k_values:
+            overlap = _intersection_statistics(ranks, k_values)
+            for c, K in enumerate(k_values):
+                samples[f"intersection_at_{K}"].append(overlap[:, c])
+    return {name: np.sort(np.concatenate(parts)) for name, parts in samples.items()}
+
+
+def null_distributions(k, n, statistics, draws=NULL_DRAWS, seed=0, cache_dir=CACHE_DIR):
+    """Sorted null samples of Kendall's W ("kendall_w") and/or mean pairwise intersection@K
+    ("intersection_at_{K}") for k independent random rankings of n features.
+
+    Every statistic of one (k, n) is read from the same set of random rankings, so asking for many K values
+    costs one simulation. Each null is kept in memory and, with a cache_dir, saved under <cache_dir>/nulls so
+    later runs and worker processes load it instead; statistics that are missing from the cache are simulated
+    together from the same rankings.
+    """
+    nulls = {}
+    missing = []
+    for name in statistics:
+        key = (name, k, n, draws, seed)
+        if key not in _NULLS and cache_dir:
+            path = os.path.join(cache_dir, "nulls", "_".join(map(str, key)) + ".npy")
+            if os.path.exists(path):
+                _NULLS[key] = np.load(path)
+        if key in _NULLS:
+            nulls[name] = _NULLS[key]
+        else:
+            missing.append(name)
+
+    for name, null in (_simulate(missing, k, n, draws, seed) if missing else {}).items():
+        key = (name, k, n, draws, seed)
+        if cache_dir:
+            path = os.path.join(cache_dir, "nulls", "_".join(map(str, key)) + ".npy")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Workers that need the same null simulate it concurrently; each writes its own temporary file
+            tmp = f"{path}.{os.getpid()}.tmp.npy"
+            np.save(tmp, null)
+            os.replace(tmp, path)
+        _NULLS[key] = nulls[name] = null
+    return nulls
+
+
+def null_distribution(metric, k, n, K=0, draws=NULL_DRAWS, seed=0, cache_dir=CACHE_DIR):
+    """Sorted null of one statistic ("kendall_w", or "intersection" with K); see null_distributions."""
+    if metric not in ("kendall_w", "intersection"):
+        raise ValueError(f"Unknown null metric: {metric}")
+    name = _statistic_name(metric, K)
+    return null_distributions(k, n, [name], draws, seed, cache_dir)[name]
+
+
+def upper_p_values(observed, null):
+    """One-sided p-value P(null >= observed), with the +1 correction so it is never 0."""
+    # A small tolerance keeps floating-point noise in W from moving an observed value past an equal null draw
+    exceed = len(null) - np.searchsorted(null, observed - 1e-12, side="left")
+    return (1 + exceed) / (1 + len(null))
+
+
+def batch_p_values(observed, k_eff, draws=NULL_DRAWS, seed=0, cache_dir=CACHE_DIR):
+    """p-values for several statistics at once.
+
+    observed maps a statistic name ("kendall_w", "intersection_at_{K}") to (values, n_eff), N rows each. One
+    set of random rankings is simulated per distinct (methods, features) combination and shared by every
+    statistic that needs it. NaN where the observed value is NaN or fewer than two methods / features are
+    available.
+    """
+    valid = {}
+    needed = {}
+    for name, (values, n_eff) in observed.items():
+        valid[name] = ~np.isnan(values) & (k_eff >= 2) & (n_eff >= 2)
+        for k, n in set(zip(k_eff[valid[name]].tolist(), n_eff[valid[name]].tolist())):
+            needed.setdefault((k, n), []).append(name)
+
+    p = {name: np.full(np.shape(values), np.nan) for name, (values, _) in observed.items()}
+    for (k, n), names in needed.items():
+        nulls = null_distributions(k, n, names, draws, seed, cache_dir)
+        for name in names:
+            values, n_eff = observed[name]
+            rows = valid[name] & (k_eff == k) & (n_eff == n)
+            p[name][rows] = upper_p_values(np.asarray(values, dtype=float)[rows], nulls[name])
+    return p
+
+
+def tied_kendall_w_p_values(values, feature_mask, method_mask, observed, p, draws=NULL_DRAWS, seed=0):
+    """Replace the W p-values of rows whose ranks contain ties with an exact permutation p-value.
+
+    The shared nulls are simulated from untied rankings, but W is tie-corrected, so a row with ties is instead
+    compared with random shuffles of its own average ranks (each method's ranks permuted independently over
+    the features). The tie term is unchanged by a shuffle, so every draw uses the row's own denominator. Rows
+    with ties are rare on the common features of real explanations, which keeps this per-row cost small.
+    """
+    observed = np.asarray(observed, dtype=float)
+    ranks, ties = rank_data(values, feature_mask[:, None, :] & method_mask[:, :, None], return_ties=True)
+    ties = ties.sum(axis=1)
+    p = np.array(p, dtype=float)
+    for row in np.flatnonzero((ties > 0) & ~np.isnan(observed)):
+        r = ranks[row][method_mask[row]][:, feature_mask[row]]
+        k, n = r.shape
+        denominator = k ** 2 * (n ** 3 - n) - k * ties[row]
+        rng = np.random.default_rng(np.random.SeedSequence([seed, k, n, 1]))
+        block = max(1, BLOCK_SIZE // (k * n))
+        null = []
+        for start in range(0, draws, block):
+            order = rng.random((min(block, draws - start), k, n)).argsort(axis=-1)
+            R = np.take_along_axis(np.broadcast_to(r, order.shape), order, axis=-1).sum(axis=1)
+            null.append(12 * ((R - k * (n + 1) / 2) ** 2).sum(axis=-1) / denominator)
+        p[row] = upper_p_values(observed[row], np.sort(np.concatenate(null)))
+    return p
@@ -0,0 +1,52 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from cohort_loader import list_patient_files
+
+WORKERS = os.cpu_count() or 1
+
+
+def _apply_to_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def iter_parallel(func, items, workers=WORKERS, chunksize=None, batched=False):
+    """Apply func to every item across worker processes, yielding results in input order as chunks finish.
+
+    With batched=True, func receives a whole chunk (list of items) and must return one result per item.
+    """
+    items = list(items)
+    workers = max(1, workers or 1)
+    if chunksize is None:
+        # A few chunks per worker keeps the pool busy without paying per-item IPC
+        chunksize = max(1, math.ceil(len(items) / (workers * 4)))
+    chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+    call = func if batched else partial(_apply_to_chunk, func)
+
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from call(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # executor.map yields in submission order, so the merge is deterministic
+        for chunk_result in executor.map(call, chunks):
+            yield from chunk_result
+
+
+def run_parallel(func, items, workers=WORKERS, chunksize=None, batched=False):
+    return list(iter_parallel(func, items, workers, chunksize, batched))
+
+
+def iter_per_patient(func, data_dir, workers=WORKERS, chunksize=None, batched=False, skip=()):
+    """Yield (filename, func(path)) for every patient file in data_dir not listed in skip."""
+    files = [filename for filename in list_patient_files(data_dir) if filename not in skip]
+    paths = [os.path.join(data_dir, filename) for filename in files]
+    yield from zip(files, iter_parallel(func, paths, workers, chunksize, batched))
+
+
+def run_per_patient(func, data_dir, workers=WORKERS, chunksize=None, batched=False):
+    """Run a per-file function (e.g. process_file) over every patient file in data_dir, keyed by filename."""
+    return dict(iter_per_patient(func, data_dir, workers, chunksize, batched))
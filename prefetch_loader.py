@@ -0,0 +1,63 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from names import load_explanation
+
+# Files read at the same time; on network storage the reads, not the parsing, are what takes the time
+PREFETCH_THREADS = 8
+# Files that may be read ahead of the consumer; reading pauses while this many are waiting
+PREFETCH_BUFFER = 32
+
+
+def iter_prefetched(paths, load=load_explanation, threads=PREFETCH_THREADS, buffer=PREFETCH_BUFFER):
+    """Yield load(path) for every path, in order, while a thread pool reads the next ones.
+
+    At most `buffer` files are in flight or parsed and waiting. A slow consumer therefore holds the reads back
+    and memory stays bounded. A failed load raises at its position in the stream. threads <= 1 loads serially.
+    """
+    if threads <= 1:
+        for path in paths:
+            yield load(path)
+        return
+
+    buffer = max(buffer, threads)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        try:
+            for path in paths:
+                pending.append(executor.submit(load, path))
+                if len(pending) >= buffer:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # A consumer that stops early (or an error) should not wait for reads nobody will use
+            for future in pending:
+                future.cancel()
+
+
+def process_in_blocks(func, paths, size=PREFETCH_BUFFER, threads=PREFETCH_THREADS):
+    """Concatenated func(records) over blocks of up to `size` (filename, explanation) records, in path order.
+
+    While func computes on one block the pool is already reading the next, so a batched analysis overlaps its
+    reads with its own computation, and only about two blocks of files are held in memory at a time.
+    """
+    paths = list(paths)
+    # No more threads than files: a single-file call reads it directly. With one more file than a block in the
+    # buffer, the whole next block is in flight once the current one has been handed out
+    loaded = iter_prefetched(paths, threads=min(threads, len(paths)), buffer=size + 1)
+    results = []
+    for start in range(0, len(paths), size):
+        block = paths[start:start + size]
+        results.extend(func([(os.path.basename(path), data) for path, data in zip(block, loaded)]))
+    return results
+
+
+def worker_threads(workers, threads=PREFETCH_THREADS):
+    """Prefetch threads per worker process.
+
+    `threads` (PREFETCH_THREADS) is the budget of concurrent reads for the whole run, not for each worker, so
+    the workers together keep about that many reads in flight.
+    """
+    return max(1, threads // max(1, workers or 1))
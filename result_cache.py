@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import hashlib
+
+from cohort_loader import list_patient_files
+from parallel_driver import WORKERS, iter_parallel
+
+CACHE_DIR = ".metric_cache"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version(*module_names):
+    """Hash the source of the (imported) modules that produce a metric, so editing them invalidates the cache."""
+    h = hashlib.sha256()
+    for name in module_names:
+        with open(sys.modules[name].__file__, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def config_key(config, version):
+    payload = json.dumps({"config": config, "code_version": version}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def cached_iter_per_patient(func, data_dir, config, version, cache_dir=CACHE_DIR,
+                            workers=WORKERS, chunksize=None, batched=False, skip=()):
+    """Like iter_per_patient, but only recomputes files whose content hash is not cached for this config/code.
+
+    Cached patients are yielded first, then freshly computed ones as they finish.
+    """
+    entry_dir = os.path.join(cache_dir, config_key(config, version))
+    os.makedirs(entry_dir, exist_ok=True)
+
+    missing = []
+    for filename in list_patient_files(data_dir):
+        if filename in skip:
+            continue
+        path = os.path.join(data_dir, filename)
+        entry = os.path.join(entry_dir, file_digest(path) + ".json")
+        if os.path.exists(entry):
+            with open(entry, 'r') as f:
+                yield filename, json.load(f)
+        else:
+            missing.append((filename, path, entry))
+
+    computed = iter_parallel(func, [path for _, path, _ in missing], workers, chunksize, batched)
+    for (filename, _, entry), result in zip(missing, computed):
+        tmp = entry + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp, entry)
+        yield filename, result
+
+
+def cached_run_per_patient(func, data_dir, config, version, cache_dir=CACHE_DIR,
+                           workers=WORKERS, chunksize=None, batched=False):
+    results = dict(cached_iter_per_patient(func, data_dir, config, version, cache_dir, workers, chunksize, batched))
+    return {filename: results[filename] for filename in sorted(results)}
@@ -0,0 +1,130 @@
+import numpy as np
+
+from cohort_loader import intern_records, iter_patient_files, make_cohort, read_only
+
+DATA_DIR = "patient_contributions_DataSet1"
+methods = ["SHAP", "Lime", "Inherent"]
+
+
+def make_sparse_cohort(patients, models, methods, features, indptr, indices, data, method_mask):
+    """Like cohort_loader.make_cohort, but the non-zero values are kept in CSR form.
+
+    Row (p * models + mi) * methods + k holds the sorted feature indices and values of patient p, model mi and
+    method k, between indptr[row] and indptr[row + 1]. There is no feature_mask: a thresholded value is simply
+    not stored, and only the non-zero features enter the common-feature metrics.
+    """
+    cohort = make_cohort(patients, models, methods, features, None, method_mask, None, None)
+    del cohort["values"], cohort["feature_mask"], cohort["presence"]
+    cohort.update(indptr=read_only(indptr), indices=read_only(indices), data=read_only(data))
+    return cohort
+
+
+def build_sparse_cohort(records, methods=methods, threshold=0, dtype=np.float64, models=None, features=None):
+    """Pack records into CSR rows of the values that survive the threshold (see cohort_loader.intern_records)."""
+    patients, models, features, entries = intern_records(records, methods, dtype, models, features, threshold)
+    K = len(methods)
+    method_mask = np.zeros((len(patients), len(models), K), dtype=bool)
+    rows = np.empty(len(entries), dtype=np.intp)
+    for e, (p, mi, k, _, _) in enumerate(entries):
+        method_mask[p, mi, k] = True
+        rows[e] = (p * len(models) + mi) * K + k
+
+    # Sections arrive in file order; rows are laid out by (patient, model, method) with sorted features
+    order = np.argsort(rows, kind="stable")
+    counts = np.zeros(method_mask.size, dtype=np.intp)
+    counts[rows] = [len(entries[e][3]) for e in range(len(entries))]
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    data = np.empty(indptr[-1], dtype=dtype)
+    for e in order:
+        _, _, _, idx, vals = entries[e]
+        by_feature = np.argsort(idx)
+        start = indptr[rows[e]]
+        indices[start:start + len(idx)] = idx[by_feature]
+        data[start:start + len(idx)] = vals[by_feature]
+    return make_sparse_cohort(patients, models, list(methods), features, indptr, indices, data, method_mask)
+
+
+def load_sparse_cohort(data_dir=DATA_DIR, methods=methods, threshold=0, dtype=np.float64, models=None,
+                       features=None):
+    return build_sparse_cohort(iter_patient_files(data_dir), methods, threshold, dtype, models, features)
+
+
+def to_sparse(cohort, threshold=0):
+    """CSR form of a dense cohort (e.g. a slice of a .cohort store), keeping values with abs(v) >= threshold."""
+    values = cohort["values"]
+    P, M, K, F = values.shape
+    present = cohort["feature_mask"][:, :, None, :] & cohort["method_mask"][..., None]
+    keep = (present & (values != 0) & ~(np.abs(values) < threshold)).reshape(P * M * K, F)
+    rows, cols = np.nonzero(keep)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=P * M * K))])
+    data = np.asarray(values).reshape(P * M * K, F)[rows, cols]
+    return make_sparse_cohort(cohort["patients"], cohort["models"], cohort["methods"], cohort["features"],
+                              indptr, cols.astype(np.int32), data, cohort["method_mask"])
+
+
+def common_features(cohort):
+    """Features that are non-zero in every present method of each (patient, model), from the index sets alone.
+
+    Returns (group, feature, slot, n_common): for every common feature its (patient * models + model) group,
+    its feature index and its position among the group's common features (in feature order), plus the number
+    of common features per group. Cost is one sort of the stored non-zeros.
+    """
+    P, M, K = cohort["method_mask"].shape
+    F = len(cohort["features"])
+    G = P * M
+    indptr, indices = cohort["indptr"], cohort["indices"]
+    group = np.repeat(np.arange(G * K), np.diff(indptr)) // K
+    key = group.astype(np.int64) * F + indices
+    keys, counts = np.unique(key, return_counts=True)
+    # Each method stores a feature at most once, so a feature is common when every present method has it
+    k_eff = cohort["method_mask"].reshape(G, K).sum(axis=1)
+    common = keys[counts == k_eff[keys // F]]
+    common_group = common // F
+    n_common = np.bincount(common_group, minlength=G)
+    first = np.cumsum(n_common) - n_common
+    slot = np.arange(len(common)) - first[common_group]
+    return common_group, common % F, slot, n_common
+
+
+def compact_common(cohort):
+    """Dense cohort whose feature axis holds only each (patient, model)'s common features.
+
+    The width is the largest common set rather than the feature vocabulary, and features keep their order, so
+    the dense metrics (metrics_engine.compute_metrics with the "common" feature scope) give the same results
+    as on the full tensor. "feature_ids" maps every (patient, model, slot) back to its feature index (-1 =
+    padding).
+    """
+    P, M, K = cohort["method_mask"].shape
+    F = len(cohort["features"])
+    G = P * M
+    common_group, common_feature, slot, n_common = common_features(cohort)
+    width = int(n_common.max(initial=0))
+    feature_ids = np.full((G, width), -1, dtype=np.intp)
+    feature_ids[common_group, slot] = common_feature
+
+    # Look up each stored value's slot by its (group, feature) key; non-common values have none
+    indptr = cohort["indptr"]
+    row = np.repeat(np.arange(G * K), np.diff(indptr))
+    key = (row // K).astype(np.int64) * F + cohort["indices"]
+    common_key = common_group.astype(np.int64) * F + common_feature
+    found = np.searchsorted(common_key, key)
+    found[found == len(common_key)] = 0
+    stored = (common_key[found] == key) if len(common_key) else np.zeros(len(key), dtype=bool)
+    values = np.zeros((G, K, width), dtype=cohort["data"].dtype)
+    values[row[stored] // K, row[stored] % K, slot[found[stored]]] = cohort["data"][stored]
+    presence = np.zeros((G, K, width), dtype=bool)
+    presence[row[stored] // K, row[stored] % K, slot[found[stored]]] = True
+
+    compact = make_cohort(cohort["patients"], cohort["models"], cohort["methods"], list(range(width)),
+                          values.reshape(P, M, K, width), cohort["method_mask"],
+                          (feature_ids >= 0).reshape(P, M, width), presence.reshape(P, M, K, width))
+    compact["feature_ids"] = read_only(feature_ids.reshape(P, M, width))
+    return compact
+
+
+if __name__ == "__main__":
+    cohort = load_sparse_cohort(DATA_DIR, threshold=1)
+    dense = cohort["method_mask"].sum() * len(cohort["features"])
+    print(f"✅ Loaded {len(cohort['patients'])} patients from '{DATA_DIR}': {len(cohort['data'])} non-zero values "
+          f"stored of {dense} dense entries.")
@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+
+import aggregate_metrics
+from aggregate_metrics import QUANTILES, accumulate, aggregate_file, new_accumulator, summarize
+from ndjson_io import close_stream, open_stream, write_record
+
+
+def _result(i):
+    return {"XGBOOST": {"kendall_w": (i * 37 % 101) / 100, "intersection_at_5": None if i % 7 == 0 else i / 200}}
+
+
+def _write_stream(path, n):
+    # A completed stream is started over by the next run, as metrics_engine.run does
+    stream, _ = open_stream(path, header={"run": 1})
+    for i in range(n):
+        write_record(stream, {"patient": f"patient_{i}.json", "result": _result(i)})
+    close_stream(stream)
+
+
+def _count_accumulate(monkeypatch):
+    calls = []
+
+    def counted(acc, value):
+        calls.append(value)
+        accumulate(acc, value)
+
+    monkeypatch.setattr(aggregate_metrics, "accumulate", counted)
+    return calls
+
+
+def test_rerun_with_new_patients_folds_only_them(tmp_path, monkeypatch):
+    stream, state = str(tmp_path / "results.ndjson"), str(tmp_path / "results.state")
+    _write_stream(stream, 190)
+    aggregate_file(stream, str(tmp_path / "averages.json"), state_file=state)
+
+    _write_stream(stream, 200)
+    calls = _count_accumulate(monkeypatch)
+    aggregate_file(stream, str(tmp_path / "averages.json"), str(tmp_path / "summary.json"), state_file=state)
+    assert len(calls) == 10 * 2
+
+    monkeypatch.undo()
+    aggregate_file(stream, str(tmp_path / "fresh.json"), str(tmp_path / "fresh_summary.json"))
+    for kept, fresh in [("averages.json", "fresh.json"), ("summary.json", "fresh_summary.json")]:
+        assert json.loads((tmp_path / kept).read_text()) == json.loads((tmp_path / fresh).read_text())
+
+
+def test_changed_result_rebuilds(tmp_path, monkeypatch):
+    stream, state = str(tmp_path / "results.ndjson"), str(tmp_path / "results.state")
+    _write_stream(stream, 20)
+    aggregate_file(stream, str(tmp_path / "averages.json"), state_file=state)
+
+    handle, _ = open_stream(stream, header={"run": 2})
+    for i in range(20):
+        write_record(handle, {"patient": f"patient_{i}.json", "result": _result(i + 1)})
+    close_stream(handle)
+    calls = _count_accumulate(monkeypatch)
+    aggregate_file(stream, str(tmp_path / "averages.json"), state_file=state)
+    assert len(calls) == 20 * 2
+
+
+def test_quantiles_exact_for_small_cohorts_and_close_for_large():
+    rng = np.random.default_rng(0)
+    for n, tolerance in [(7, 1e-4), (500, 1e-4), (5000, 0.05)]:
+        values = rng.normal(size=n)
+        acc = new_accumulator()
+        for value in values:
+            accumulate(acc, float(value))
+        estimated = [summarize(acc)["quantiles"][str(q)] for q in QUANTILES]
+        assert np.allclose(estimated, np.quantile(values, QUANTILES), atol=tolerance)
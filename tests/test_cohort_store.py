@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from cohort_loader import build_cohort, slice_cohort
+from cohort_store import open_cohort, read_header, save_cohort
+
+RECORDS = [
+    ("a.json", {"XGBOOST": {"SHAP": {"age": 0.0, "bmi": 0.3}, "Lime": {"bmi": -0.1, "hr": 0.2}}}),
+    ("b.json", {"XGBOOST": {"SHAP": {"hr": 0.5}, "Lime": {"age": 0.0}}}),
+]
+
+
+def test_method_selection_keeps_listed_zeros(tmp_path):
+    cohort = build_cohort(RECORDS, ["SHAP", "Lime"])
+    path = str(tmp_path / "c.cohort")
+    save_cohort(cohort, path)
+    for source in (cohort, open_cohort(path)):
+        for selected in (["SHAP"], ["Lime"]):
+            sliced = slice_cohort(source, methods=selected)
+            fresh = build_cohort(RECORDS, selected, features=cohort["features"])
+            for key in ("values", "method_mask", "feature_mask", "presence"):
+                assert np.array_equal(sliced[key], fresh[key]), (selected, key)
+    # "age" is listed with value 0 by SHAP for patient a and by Lime for patient b
+    assert slice_cohort(cohort, methods=["SHAP"])["feature_mask"][0, 0, cohort["feature_index"]["age"]]
+    assert slice_cohort(cohort, methods=["Lime"])["feature_mask"][1, 0, cohort["feature_index"]["age"]]
+
+
+def test_older_store_format_is_rejected(tmp_path):
+    path = tmp_path / "old.cohort"
+    path.write_bytes(b"XCOHORT1" + bytes(16))
+    with pytest.raises(ValueError, match="older cohort store format"):
+        read_header(str(path))
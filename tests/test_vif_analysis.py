@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from cohort_loader import build_cohort
+from vif_analysis import compute_vif, compute_vif_batch, methods, vif_results_for_cohort
+
+
+def test_empty_blocks():
+    for shape in [(0, 3, 5), (4, 3, 0), (0, 3, 0)]:
+        vif, rank, condition_number, col_mask = compute_vif_batch(np.zeros(shape))
+        assert vif.shape == (shape[0], shape[2]) and col_mask.shape == (shape[0], shape[2])
+        assert rank.shape == condition_number.shape == (shape[0],)
+
+
+def test_patients_without_features():
+    records = [("empty.json", {}), ("no_methods.json", {"XGBOOST": {}}),
+               ("no_features.json", {"XGBOOST": {"SHAP": {}, "Lime": {}}})]
+    assert vif_results_for_cohort(build_cohort(records, methods)) == [{}, {}, {}]
+
+
+@pytest.mark.parametrize("centered", [False, True])
+def test_matches_statsmodels(centered):
+    pytest.importorskip("statsmodels")
+    from statsmodels.stats.outliers_influence import variance_inflation_factor
+
+    X = np.random.default_rng(0).normal(size=(1, 6, 3))
+    vif = compute_vif_batch(X, centered=centered)[0][0]
+    expected = [variance_inflation_factor(X[0], i, standardize=centered) for i in range(3)]
+    assert np.allclose(vif, expected)
+    if not centered:
+        explanations = {f"f{i}": X[0, :, i].tolist() for i in range(3)}
+        assert np.allclose(vif, compute_vif(explanations).sort_index()["VIF"])
+
+
+def test_singular_by_construction():
+    X = np.random.default_rng(1).normal(size=(2, 3, 5))
+    vif, rank, _, _ = compute_vif_batch(X)
+    assert rank.tolist() == [3, 3]
+    assert np.isinf(vif).all()
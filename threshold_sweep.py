@@ -0,0 +1,104 @@
+import json
+import argparse
+
+import numpy as np
+
+from aggregate_metrics import aggregate_records, summarize
+from cohort_loader import slice_cohort
+from cohort_store import load_any_cohort
+from metrics_engine import (DEFAULT_CONFIG, PRESETS, flat_arrays, k_range, metric_arrays, metrics_to_results,
+                            pair_indices, validate_config)
+
+DATA_DIR = "patient_contributions_DataSet1"
+THRESHOLDS = [0, 0.01, 0.05, 0.1, 0.5, 1]
+OUTPUT_FILE = "threshold_sweep_DataSet1.json"
+# Patients per block; bounds the kernels' working arrays
+CHUNK_PATIENTS = 2000
+
+
+def sweep_metrics(cohort, config, thresholds):
+    """metrics_engine.compute_metrics for every threshold, from one loaded cohort.
+
+    The cohort is only read; each threshold's common features come from comparing one precomputed
+    per-feature minimum |value| against it.
+    """
+    P, M = cohort["method_mask"].shape[:2]
+    values, method_mask, feature_mask = flat_arrays(cohort)
+    magnitude = np.abs(values)
+    # A feature is common at threshold t when its smallest |value| over the present methods is non-zero and >= t
+    floor = np.where(method_mask[..., None], magnitude, np.inf).min(axis=1)
+    pairs = pair_indices(cohort)
+
+    sweep = []
+    for threshold in thresholds:
+        common_mask = feature_mask & (floor > 0) & ~(floor < threshold)
+        scope_mask = common_mask if config["feature_scope"] == "common" else feature_mask
+        metrics = metric_arrays(values, method_mask, common_mask, scope_mask, pairs, dict(config, threshold=threshold))
+        sweep.append({name: array.reshape((P, M) + array.shape[1:]) for name, array in metrics.items()})
+    return sweep
+
+
+def run_sweep(config, data_dir=DATA_DIR, thresholds=THRESHOLDS, output_file=OUTPUT_FILE, per_patient=False,
+              quantiles=()):
+    config = validate_config(dict(DEFAULT_CONFIG, **config))
+    cohort = load_any_cohort(data_dir, config["methods"], config["models"])
+
+    accumulators = [{} for _ in thresholds]
+    patients = [{} for _ in thresholds]
+    for start in range(0, len(cohort["patients"]), CHUNK_PATIENTS):
+        chunk = slice_cohort(cohort, slice(start, start + CHUNK_PATIENTS))
+        for i, metrics in enumerate(sweep_metrics(chunk, config, thresholds)):
+            results = metrics_to_results(chunk, metrics, config)
+            aggregate_records(({"patient": p, "result": r} for p, r in zip(chunk["patients"], results)),
+                              accumulators[i], quantiles=quantiles)
+            if per_patient:
+                patients[i].update(zip(chunk["patients"], results))
+
+    sweep = []
+    for i, threshold in enumerate(thresholds):
+        entry = {"threshold": threshold,
+                 "summary": {model: {metric: summarize(acc) for metric, acc in model_acc.items()}
+                             for model, model_acc in accumulators[i].items()}}
+        if per_patient:
+            entry["patients"] = patients[i]
+        sweep.append(entry)
+    settings = {key: value for key, value in config.items() if key != "threshold"}
+    with open(output_file, 'w') as f:
+        json.dump({"data_dir": data_dir, "config": settings, "sweep": sweep}, f, indent=2)
+    return output_file
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Metric summaries for a grid of thresholds in one pass.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), help="start from one of the strict script configs")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="patient JSON directory or .cohort store")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=THRESHOLDS)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--per-patient", action="store_true", help="also keep every patient's result per threshold")
+    # Streaming quantiles cost more than the metrics themselves, so the sweep leaves them out unless asked
+    parser.add_argument("--quantiles", nargs="+", type=float, default=[])
+    parser.add_argument("--models", nargs="+")
+    parser.add_argument("--methods", nargs="+")
+    parser.add_argument("--top-k", nargs="+", type=k_range, help="K values or ranges, e.g. 5 10 or 1-50")
+    parser.add_argument("--zero-policy", choices=["ignore", "skip"])
+    parser.add_argument("--feature-scope", choices=["common", "all"])
+    parser.add_argument("--min-common", type=int)
+    parser.add_argument("--constant-policy", choices=["nan", "zero"])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = dict(PRESETS[args.preset]) if args.preset else dict(DEFAULT_CONFIG)
+    if args.top_k is not None:
+        config["top_k"] = sorted(set().union(*args.top_k))
+    for key in ("models", "methods", "zero_policy", "feature_scope", "min_common", "constant_policy"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+
+    output_file = run_sweep(config, args.data_dir, args.thresholds, args.output, args.per_patient, args.quantiles)
+    print(f"✅ Swept {len(args.thresholds)} thresholds. Results saved to '{output_file}'.")
+
+
+if __name__ == "__main__":
+    main()
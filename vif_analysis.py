@@ -1,13 +1,24 @@
-import os
-import json
+from functools import partial
 import numpy as np
 import pandas as pd
-from statsmodels.stats.outliers_influence import variance_inflation_factor
+from cohort_loader import build_cohort
+from cohort_store import is_store, iter_store_patients, load_store_patients, store_fingerprint
+from names import load_explanation
+from ndjson_io import close_stream, ndjson_to_json, open_stream, write_record
+from parallel_driver import WORKERS, iter_per_patient
+from prefetch_loader import PREFETCH_THREADS, process_in_blocks, worker_threads
 
 DATA_DIR = "patient_contributions_DataSet1"
 methods = ["SHAP", "Lime", "Inherent"]
+# "closed_form" reads every VIF off the inverted correlation matrix; "statsmodels" fits one OLS per feature
+VIF_BACKEND = "closed_form"
+# Condition number above which a full-rank correlation matrix is reported as near-singular
+COND_LIMIT = 1e10
+OUTPUT_FILE = "vif_analysis_results.json"
 
 def compute_vif(explanations):
+    from statsmodels.stats.outliers_influence import variance_inflation_factor
+
     df = pd.DataFrame(explanations)
 
     # סינון משתנים עם שונות אפס (כל הערכים זהים)
@@ -19,12 +30,13 @@ def compute_vif(explanations):
 
     vif_data = pd.DataFrame()
     vif_data["feature"] = df.columns
-    vif_data["VIF"] = [variance_inflation_factor(df.values, i) for i in range(df.shape[1])]
+    # The uncentered VIF of the raw columns, as in vif_analysis_results.json; statsmodels >= 0.15 standardizes
+    # the columns by default, which gives the centered VIF instead
+    vif_data["VIF"] = [variance_inflation_factor(df.values, i, standardize=False) for i in range(df.shape[1])]
     return vif_data.sort_values(by="VIF", ascending=False)
 
 def process_vif_file(filepath):
-    with open(filepath, 'r') as f:
-        data = json.load(f)
+    data = load_explanation(filepath)
 
     vif_results = {}
     for model, methods_data in data.items():
@@ -37,7 +49,7 @@ def process_vif_file(filepath):
             all_features.update(methods_data[m].keys())
 
         valid_features = []
-        for f in all_features:
+        for f in sorted(all_features):
             values = [methods_data[m].get(f, 0) for m in available_methods]
             if all(v != 0 for v in values):
                 valid_features.append(f)
@@ -56,18 +68,149 @@ def process_vif_file(filepath):
 
     return vif_results
 
-def run_vif_analysis():
-    all_vif_results = {}
-    for filename in os.listdir(DATA_DIR):
-        if filename.endswith(".json"):
-            filepath = os.path.join(DATA_DIR, filename)
-            vif_result = process_vif_file(filepath)
-            all_vif_results[filename] = vif_result
-
-    with open("vif_analysis_results.json", "w") as f:
-        json.dump(all_vif_results, f, indent=2)
-
-    print("✅ VIF analysis completed. Results saved to 'vif_analysis_results.json'.")
+def compute_vif_batch(X, row_mask=None, col_mask=None, centered=False):
+    """All VIFs for a stacked (B x observations x features) tensor from the diagonal of the inverted correlation matrix.
+
+    Returns (vif, rank, condition_number, col_mask). centered=False gives the uncentered VIF of the raw columns,
+    as compute_vif does; centered=True gives the textbook VIF.
+    """
+    X = np.asarray(X, dtype=float)
+    B, n, p = X.shape
+    row_mask = np.ones((B, n), dtype=bool) if row_mask is None else np.asarray(row_mask, dtype=bool)
+    col_mask = np.ones((B, p), dtype=bool) if col_mask is None else np.asarray(col_mask, dtype=bool)
+    if B == 0 or p == 0:
+        return np.full((B, p), np.nan), np.zeros(B, dtype=int), np.full(B, np.nan), col_mask
+
+    # סינון משתנים עם שונות אפס (כל הערכים זהים), כמו ב-compute_vif
+    rows = row_mask[:, :, None]
+    varies = np.where(rows, X, -np.inf).max(axis=1) != np.where(rows, X, np.inf).min(axis=1)
+    col_mask = col_mask & varies
+
+    if centered:
+        X = X - np.sum(X * rows, axis=1, keepdims=True) / np.maximum(row_mask.sum(axis=1), 1)[:, None, None]
+    X = X * rows * col_mask[:, None, :]
+
+    vif = np.full((B, p), np.inf)
+    rank = np.zeros(B, dtype=int)
+    condition_number = np.full(B, np.inf)
+    n_features = col_mask.sum(axis=1)
+    # More features than (centered) observations is singular by construction. Only the rank is reported for
+    # those rows, and the singular values of the small observations x features matrix give it without a p x p eigh
+    wide = n_features > row_mask.sum(axis=1) - int(centered)
+    eps = p * np.finfo(float).eps
+
+    if wide.any():
+        Xw = X[wide]
+        norm = np.sqrt((Xw ** 2).sum(axis=1))
+        Xw = Xw * np.where(col_mask[wide], 1 / np.where(col_mask[wide], norm, 1), 0)[:, None, :]
+        eigvals = np.linalg.svd(Xw, compute_uv=False) ** 2
+        rank[wide] = (eigvals > eigvals.max(axis=1, keepdims=True, initial=0) * eps).sum(axis=1)
+
+    square = ~wide
+    if square.any():
+        Xs, cols = X[square], col_mask[square]
+        G = np.matmul(Xs.transpose(0, 2, 1), Xs)
+        diag = np.sqrt(np.diagonal(G, axis1=1, axis2=2))
+        scale = np.where(cols, 1 / np.where(cols, diag, 1), 0)
+        C = G * scale[:, :, None] * scale[:, None, :]
+        # Masked-out features become independent unit columns so one batched eigh covers every row
+        idx = np.arange(p)
+        C[:, idx, idx] = 1
+
+        eigvals, eigvecs = np.linalg.eigh(C)
+        nonzero = eigvals > eigvals[:, -1:] * eps
+        rank[square] = nonzero.sum(axis=1) - (~cols).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            condition_number[square] = eigvals[:, -1] / np.maximum(eigvals[:, 0], 0)
+            vif[square] = np.sum(eigvecs ** 2 / np.where(nonzero, eigvals, 0)[:, None, :], axis=2)
+
+    vif[rank < n_features] = np.inf
+    vif[~col_mask] = np.nan
+    return vif, rank, condition_number, col_mask
+
+def process_vif_records(records):
+    return vif_results_for_cohort(build_cohort(records, methods))
+
+def process_vif_files(filepaths, threads=PREFETCH_THREADS):
+    return process_in_blocks(process_vif_records, filepaths, threads=threads)
+
+def process_vif_store_patients(patient_indices, path):
+    return vif_results_for_cohort(load_store_patients(path, patient_indices))
+
+def vif_results_for_cohort(cohort):
+    values = cohort["values"]
+    method_mask = cohort["method_mask"]
+    P, M, K, F = values.shape
+
+    # Features that are non-zero in every available method, as in process_vif_file
+    nonzero = ((values != 0) | ~method_mask[..., None]).all(axis=2)
+    feature_mask = cohort["feature_mask"] & nonzero
+    vif, rank, condition_number, col_mask = compute_vif_batch(
+        values.reshape(P * M, K, F), method_mask.reshape(P * M, K), feature_mask.reshape(P * M, F))
+    vif = vif.reshape(P, M, F)
+    rank = rank.reshape(P, M)
+    condition_number = condition_number.reshape(P, M)
+    col_mask = col_mask.reshape(P, M, F)
+
+    features = np.array(cohort["features"])
+    results = []
+    for p in range(P):
+        vif_results = {}
+        for mi, model in enumerate(cohort["models"]):
+            n_methods = int(method_mask[p, mi].sum())
+            n_features = int(col_mask[p, mi].sum())
+            if n_methods < 2 or n_features < 2:
+                continue
+
+            if rank[p, mi] < n_features:
+                # With more features than methods the matrix can never be inverted; say so instead of writing Infinity
+                vif_results[model] = {
+                    "status": "singular",
+                    "rank": int(rank[p, mi]),
+                    "n_features": n_features,
+                    "n_observations": n_methods,
+                }
+                continue
+
+            cols = np.flatnonzero(col_mask[p, mi])
+            cols = cols[np.argsort(-vif[p, mi, cols], kind="stable")]
+            vif_results[model] = {
+                "status": "near_singular" if condition_number[p, mi] > COND_LIMIT else "ok",
+                "condition_number": float(condition_number[p, mi]),
+                "vif": dict(zip(features[cols].tolist(), vif[p, mi, cols].tolist())),
+            }
+        results.append(vif_results)
+    return results
+
+def run_vif_analysis(workers=WORKERS, backend=VIF_BACKEND):
+    # Checked before the stream is opened, which would otherwise create (or start over) its file
+    if backend not in ("closed_form", "statsmodels"):
+        raise ValueError(f"Unknown VIF backend: {backend}")
+    if backend == "statsmodels" and is_store(DATA_DIR):
+        raise ValueError("The statsmodels backend reads patient JSON files; use the closed_form backend for a store")
+
+    # Each backend streams to its own file so a resumed run never mixes the two
+    stream_file = f"vif_analysis_results.{backend}.ndjson"
+    header = {"data_dir": DATA_DIR, "cond_limit": COND_LIMIT}
+    if is_store(DATA_DIR):
+        header["store"] = store_fingerprint(DATA_DIR)
+    stream, done = open_stream(stream_file, header=header)
+    if backend == "closed_form" and is_store(DATA_DIR):
+        vif_results = iter_store_patients(partial(process_vif_store_patients, path=DATA_DIR), DATA_DIR, workers,
+                                          skip=done)
+    elif backend == "closed_form":
+        vif_results = iter_per_patient(partial(process_vif_files, threads=worker_threads(workers)), DATA_DIR,
+                                       workers, batched=True, skip=done)
+    else:
+        vif_results = iter_per_patient(process_vif_file, DATA_DIR, workers, skip=done)
+
+    for filename, vif_result in vif_results:
+        write_record(stream, {"patient": filename, "result": vif_result})
+    close_stream(stream)
+
+    ndjson_to_json(stream_file, OUTPUT_FILE)
+
+    print(f"✅ VIF analysis completed. Results saved to '{OUTPUT_FILE}'.")
 
 if __name__ == "__main__":
     run_vif_analysis()